@@ -0,0 +1,77 @@
+"""
+Measures the cost of evaluating a statement as the environment grows.
+
+A parser is seeded with an environment of a given size and a plugin store
+with a fixed number of plugins, and then parses a fixed number of statements.
+The reported per-statement time should stay flat as the environment grows.
+
+Usage:
+
+    python benchmarks/env_growth.py [--statements N] [--plugins N]
+"""
+
+import argparse
+import time
+
+from safeparser.parser import Parser
+
+
+class StatementParser(Parser):
+    """
+    A parser that evaluates one statement at a time, since it overrides
+    `process_stmt`.
+    """
+
+    def process_stmt(self, stmt):
+        pass
+
+
+def make_parser(cls, variables, plugins):
+    env = {f'var{i}': i for i in range(variables)}
+    env['base'] = 0
+
+    parser = cls(env=env)
+
+    for i in range(plugins):
+        parser.plugin_store.add(list, f'plugin{i}')
+
+    return parser
+
+
+def make_content(statements):
+    return '\n'.join(
+        f'new{i} = plugin0([base, {i}])'
+        for i in range(statements)
+    )
+
+
+def run(cls, variables, plugins, statements):
+    parser = make_parser(cls, variables, plugins)
+    content = make_content(statements)
+
+    start = time.perf_counter()
+    parser.parse(content)
+    elapsed = time.perf_counter() - start
+
+    return elapsed / statements
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--statements', type=int, default=2000)
+    argparser.add_argument('--plugins', type=int, default=500)
+    args = argparser.parse_args()
+
+    print(f'{"parser":<16} {"variables":>10} {"per statement":>15}')
+
+    for cls in (Parser, StatementParser):
+        for variables in (0, 1_000, 10_000, 100_000):
+            per_statement = run(cls, variables, args.plugins, args.statements)
+            print(
+                f'{cls.__name__:<16} {variables:>10} '
+                f'{per_statement * 1e6:>12.2f} us'
+            )
+
+
+if __name__ == '__main__':
+    main()
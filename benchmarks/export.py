@@ -0,0 +1,81 @@
+"""
+Compares the throughput and peak memory of `export_jsonl` with serializing
+the same environment with `json.dumps` and writing the resulting string.
+
+Both write to the null device, so only the serialization is measured. The
+peak memory is measured separately with `tracemalloc`, since tracing memory
+slows down execution.
+
+Usage:
+
+    python benchmarks/export.py [--pairs N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from safeparser.export import export_jsonl
+
+
+def make_envs(pairs):
+    return {
+        'pairs': {'pairs': [(i, i + 1) for i in range(pairs)]},
+        'records': {
+            f'record{i}': {'id': i, 'name': f'item {i}', 'tags': ['a', 'b']}
+            for i in range(pairs // 10)
+        },
+        'nested': {'data': {f'key{i}': list(range(10)) for i in range(pairs // 10)}},
+    }
+
+
+def with_dumps(env, f):
+    f.write(json.dumps(env))
+
+
+def with_export(env, f):
+    export_jsonl(env, f)
+
+
+def measure(fn, env, repeat):
+    times = []
+
+    with open(os.devnull, 'w') as f:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(env, f)
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            fn(env, f)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return min(times), peak
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--pairs', type=int, default=1_000_000)
+    argparser.add_argument('--repeat', type=int, default=3)
+    args = argparser.parse_args()
+
+    print(f'{"env":<10} {"method":<12} {"time":>10} {"MB/s":>8} {"peak memory":>14}')
+
+    for name, env in make_envs(args.pairs).items():
+        size = len(json.dumps(env)) / 2**20
+
+        for method, fn in [('json.dumps', with_dumps), ('export', with_export)]:
+            elapsed, peak = measure(fn, env, args.repeat)
+            print(
+                f'{name:<10} {method:<12} {elapsed * 1e3:>7.0f} ms '
+                f'{size / elapsed:>8.1f} {peak / 2**20:>10.1f} MiB'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compares parsing an edited document from scratch with parsing it
+incrementally, reusing the results of the previous version. The document is
+a chain of groups of statements calling a plugin that takes some time, and
+each edit changes one statement near its end.
+
+Usage:
+
+    python benchmarks/incremental.py [--statements N] [--cost MS] [--edits N]
+"""
+
+import argparse
+import time
+
+from safeparser.incremental import IncrementalParser
+from safeparser.parser import Parser
+
+
+def make_parser(cost):
+    parser = Parser()
+
+    @parser.plugin_store.register
+    def work(*args):
+        time.sleep(cost / 1e3)
+        return list(args)
+
+    return parser
+
+
+def make_document(statements, edit):
+    # Each group of ten statements depends on the previous group
+    lines = []
+
+    for i in range(statements):
+        if i % 10 == 0 and i:
+            lines.append(f'v{i} = work(v{i - 10}, {i})')
+        else:
+            lines.append(f'v{i} = work({i})')
+
+    lines[-5] = f'v{statements - 5} = work({edit})'
+
+    return '\n'.join(lines)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--statements', type=int, default=1_000)
+    argparser.add_argument('--cost', type=float, default=0.1)
+    argparser.add_argument('--edits', type=int, default=5)
+    args = argparser.parse_args()
+
+    parser = make_parser(args.cost)
+    incremental = IncrementalParser(parser)
+    incremental.parse(make_document(args.statements, args.edits))
+
+    for method in ['scratch', 'incremental']:
+        times = []
+
+        for edit in range(args.edits):
+            document = make_document(args.statements, edit)
+
+            start = time.perf_counter()
+
+            if method == 'scratch':
+                parser.parse(document, env={})
+            else:
+                incremental.parse(document)
+
+            times.append(time.perf_counter() - start)
+
+        print(f'{method:<12} {min(times) * 1e3:>8.1f} ms per edit')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Compares the time and peak memory of consuming the pairs of `n` entities in
+chunks, when the pairs are materialized as a list of tuples and when they are
+a lazy `Pairs` sequence. The peak memory is measured separately with
+`tracemalloc`, since tracing memory slows down execution.
+
+Usage:
+
+    python benchmarks/sequences.py [--entities N ...] [--chunk N]
+"""
+
+import argparse
+import itertools
+import time
+import tracemalloc
+
+from safeparser.sequences import Pairs
+
+
+def materialized(entities, chunk):
+    pairs = list(itertools.combinations(entities, 2))
+    consume(pairs[i:i + chunk] for i in range(0, len(pairs), chunk))
+
+
+def lazy(entities, chunk):
+    consume(Pairs(entities).chunks(chunk))
+
+
+def consume(chunks):
+    for chunk in chunks:
+        for a, b in chunk:
+            pass
+
+
+def measure(fn, entities, chunk):
+    start = time.perf_counter()
+    fn(entities, chunk)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        fn(entities, chunk)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument(
+        '--entities', type=int, nargs='+', default=[1_000, 2_000, 4_000]
+    )
+    argparser.add_argument('--chunk', type=int, default=10_000)
+    args = argparser.parse_args()
+
+    print(f'{"entities":>8} {"method":<14} {"time":>10} {"peak memory":>14}')
+
+    for n in args.entities:
+        entities = [f'entity{i}' for i in range(n)]
+
+        for method, fn in [('materialized', materialized), ('lazy', lazy)]:
+            elapsed, peak = measure(fn, entities, args.chunk)
+            print(
+                f'{n:>8} {method:<14} {elapsed * 1e3:>7.0f} ms '
+                f'{peak / 2**20:>10.1f} MiB'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Compares the startup time of a worker whose plugin store imports every plugin
+module eagerly with one whose plugins are registered lazily, as `'module:attr'`
+strings, and are only imported when the parsed input calls them.
+
+The plugins live in generated modules that do some work when imported, as
+modules with heavy dependencies do. Each measurement runs in a new Python
+process, from its start until it has parsed an input calling a few plugins,
+and the reported time is the best of several repeats.
+
+Usage:
+
+    python benchmarks/startup.py [--plugins N] [--calls N] [--import-cost N]
+                                 [--repeat N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+WORKER = '''
+import sys
+
+from safeparser.parser import Parser
+
+plugins, calls, mode = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+parser = Parser()
+
+for i in range(plugins):
+    if mode == 'eager':
+        module = __import__(f'heavy_plugin{i}')
+        parser.plugin_store.add(module.plugin, f'plugin{i}')
+    else:
+        parser.plugin_store.add_lazy(f'heavy_plugin{i}:plugin', f'plugin{i}')
+
+parser.parse('\\n'.join(f'a{i} = plugin{i}({i})' for i in range(calls)))
+'''
+
+MODULE = '''
+TABLE = {{i: str(i) for i in range({import_cost})}}
+
+def plugin(x):
+    return TABLE.get(x)
+'''
+
+
+def write_modules(directory, plugins, import_cost):
+    for i in range(plugins):
+        path = os.path.join(directory, f'heavy_plugin{i}.py')
+
+        with open(path, 'w') as f:
+            f.write(MODULE.format(import_cost=import_cost))
+
+
+def measure(directory, plugins, calls, mode, repeat):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([
+        directory, os.getcwd(), env.get('PYTHONPATH', ''),
+    ])
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', WORKER, str(plugins), str(calls), mode],
+            env=env,
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--plugins', type=int, default=300)
+    argparser.add_argument('--calls', type=int, default=3)
+    argparser.add_argument('--import-cost', type=int, default=10_000)
+    argparser.add_argument('--repeat', type=int, default=5)
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_modules(directory, args.plugins, args.import_cost)
+
+        print(f'{"store":<8} {"startup":>10}')
+
+        for mode in ['eager', 'lazy']:
+            elapsed = measure(
+                directory, args.plugins, args.calls, mode, args.repeat
+            )
+            print(f'{mode:<8} {elapsed * 1e3:>7.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
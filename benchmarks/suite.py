@@ -0,0 +1,299 @@
+"""
+Measures the time and peak memory of parsing synthetic programs and of SafeEnv
+operations. The SafeEnv operations are timed in batches of `OPERATIONS` calls
+on an environment that was already used once, and the first use of an
+environment is timed separately.
+
+Each benchmark generates its input along one dimension (the number of
+statements, variables or plugins, the size or nesting depth of literals, or
+the share of statements calling plugins that take the environment), while
+the others stay fixed. The reported time is the best of several repeats, and
+the peak memory is measured separately with `tracemalloc`, since tracing
+memory slows down execution.
+
+Results can be saved as a baseline, and later runs compared against it. A
+benchmark is reported as a regression when its time or peak memory exceeds
+the baseline by more than the tolerance, in which case the exit status is 1.
+
+Usage:
+
+    python benchmarks/suite.py [--filter TEXT] [--repeat N]
+                               [--save FILE] [--compare FILE] [--tolerance F]
+"""
+
+import argparse
+import ast
+import json
+import sys
+import time
+import tracemalloc
+
+from safeparser.parser import Parser, SafeCodeValidator
+from safeparser.plugins import PluginStore
+from safeparser.safe_env import SafeEnv
+
+
+def make_parser(variables=0, plugins=1):
+    env = {f'var{i}': i for i in range(variables)}
+    env['base'] = 0
+
+    parser = Parser(env=env)
+    parser.plugin_store.add(list, 'plugin0')
+
+    for i in range(1, plugins):
+        parser.plugin_store.add(list, f'plugin{i}')
+
+    def count(*, env):
+        return len(env)
+
+    parser.plugin_store.add(count)
+
+    return parser
+
+
+def make_statements(statements, plugins=1):
+    return '\n'.join(
+        f'new{i} = plugin{i % plugins}([base, {i}])'
+        for i in range(statements)
+    )
+
+
+def bench_statements(statements):
+    parser = make_parser()
+    content = make_statements(statements)
+
+    return lambda: parser.parse(content)
+
+
+def bench_variables(variables):
+    parser = make_parser(variables=variables)
+    content = make_statements(1000)
+
+    return lambda: parser.parse(content)
+
+
+def bench_plugins(plugins):
+    parser = make_parser(plugins=plugins)
+    content = make_statements(1000, plugins)
+
+    return lambda: parser.parse(content)
+
+
+def bench_literal_size(size):
+    parser = make_parser()
+    content = 'a = [' + ', '.join(str(i) for i in range(size)) + ']'
+
+    return lambda: parser.parse(content)
+
+
+def bench_literal_depth(depth):
+    parser = make_parser()
+    content = '\n'.join(
+        f'a{i} = ' + '[' * depth + '0' + ']' * depth
+        for i in range(100)
+    )
+
+    return lambda: parser.parse(content)
+
+
+def bench_validate_literal(size):
+    # Only the validation is measured, on literals of several megabytes
+    content = 'a = [' + ', '.join(
+        f'({i}, "item{i}", {{"x": {i}.5}})'
+        for i in range(size)
+    ) + ']'
+
+    root = ast.parse(content)
+    plugin_store = PluginStore()
+
+    return lambda: SafeCodeValidator(plugin_store).visit(root)
+
+
+def bench_env_share(percent):
+    parser = make_parser()
+    content = '\n'.join(
+        f'new{i} = count()' if i % 100 < percent else f'new{i} = plugin0([{i}])'
+        for i in range(1000)
+    )
+
+    return lambda: parser.parse(content)
+
+
+# The first use of a SafeEnv scans its inner dictionary, which is measured
+# on its own; the other benchmarks use the environment once before timing it,
+# and time many operations, since each of them is fast
+OPERATIONS = 100
+
+
+def make_safe_env(visible=1_000, hidden=100_000):
+    # The hidden keys are inserted last, which is the worst case of `popitem`
+    inner = {f'var{i}': i for i in range(visible)}
+    inner.update((f'__hidden{i}__', i) for i in range(hidden))
+
+    return SafeEnv(inner)
+
+
+def make_used_safe_env(visible=1_000, hidden=100_000):
+    env = make_safe_env(visible, hidden)
+    len(env)
+
+    return env
+
+
+def repeated(operation):
+    def run():
+        for _ in range(OPERATIONS):
+            operation()
+
+    return run
+
+
+def bench_safe_env_first_use(hidden):
+    env = make_safe_env(hidden=hidden)
+
+    return lambda: len(env)
+
+
+def bench_safe_env_len(hidden):
+    env = make_used_safe_env(hidden=hidden)
+
+    return repeated(lambda: len(env))
+
+
+def bench_safe_env_items(hidden):
+    env = make_used_safe_env(hidden=hidden)
+
+    return repeated(lambda: list(env.items()))
+
+
+def bench_safe_env_popitem(hidden):
+    env = make_used_safe_env(hidden=hidden)
+
+    return repeated(env.popitem)
+
+
+def bench_safe_env_update(hidden):
+    env = make_used_safe_env(visible=0, hidden=hidden)
+    other = {f'var{i}': i for i in range(1_000)}
+
+    return repeated(lambda: env.update(other))
+
+
+BENCHMARKS = [
+    (f'{name}-{size}', bench, size)
+    for name, bench, sizes in [
+        ('statements', bench_statements, [100, 1_000, 10_000]),
+        ('variables', bench_variables, [0, 10_000, 100_000]),
+        ('plugins', bench_plugins, [1, 100, 1_000]),
+        ('literal-size', bench_literal_size, [1_000, 10_000, 100_000]),
+        ('literal-depth', bench_literal_depth, [1, 10, 50]),
+        ('validate-literal', bench_validate_literal, [10_000, 100_000]),
+        ('env-share', bench_env_share, [0, 10, 50, 100]),
+        ('safe-env-first-use', bench_safe_env_first_use, [0, 100_000]),
+        ('safe-env-len', bench_safe_env_len, [0, 100_000]),
+        ('safe-env-items', bench_safe_env_items, [0, 100_000]),
+        ('safe-env-popitem', bench_safe_env_popitem, [0, 100_000]),
+        ('safe-env-update', bench_safe_env_update, [0, 100_000]),
+    ]
+    for size in sizes
+]
+
+
+def measure(bench, size, repeat):
+    # Each run starts from a fresh setup, since parsing modifies the
+    # environment, and the setup is neither timed nor traced
+    times = []
+
+    for _ in range(repeat):
+        run = bench(size)
+
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    run = bench(size)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'time': min(times), 'peak': peak}
+
+
+# Below these values, differences are mostly noise (timer resolution, cache
+# effects or unrelated allocations), so they are never reported as regressions
+NOISE = {'time': 1e-3, 'peak': 1024}
+
+
+def compare(result, baseline, tolerance):
+    regressions = [
+        metric
+        for metric in ('time', 'peak')
+        if result[metric] > baseline[metric] * (1 + tolerance)
+        and result[metric] > NOISE[metric]
+    ]
+
+    ratios = ' '.join(
+        f'{metric} x{result[metric] / baseline[metric]:.2f}'
+        if baseline[metric] else f'{metric} x-'
+        for metric in ('time', 'peak')
+    )
+
+    return regressions, ratios
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--filter', default='')
+    argparser.add_argument('--repeat', type=int, default=5)
+    argparser.add_argument('--save')
+    argparser.add_argument('--compare')
+    argparser.add_argument('--tolerance', type=float, default=0.25)
+    args = argparser.parse_args()
+
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    failed = False
+
+    print(f'{"benchmark":<24} {"time":>12} {"peak memory":>14}')
+
+    for name, bench, size in BENCHMARKS:
+        if args.filter not in name:
+            continue
+
+        result = results[name] = measure(bench, size, args.repeat)
+
+        line = (
+            f'{name:<24} {result["time"] * 1e3:>9.3f} ms '
+            f'{result["peak"] / 1024:>11.1f} KiB'
+        )
+
+        if name in baseline:
+            regressions, ratios = compare(
+                result, baseline[name], args.tolerance
+            )
+            line += f'  {ratios}'
+
+            if regressions:
+                line += '  REGRESSION'
+                failed = True
+
+        print(line)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Measures the throughput of a single parser shared by several threads, each
+parsing the same content into an environment of its own. The parser caches
+its programs, so the content is only compiled once.
+
+Parsing is mostly pure Python, so CPU-bound content does not run faster with
+more threads; the `--sleep` option makes a plugin sleep for the given number
+of milliseconds, as plugins that wait for I/O do, which is where threads help.
+
+Usage:
+
+    python benchmarks/threads.py [--threads N ...] [--parses N]
+                                 [--statements N] [--sleep MS]
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from safeparser.cache import ProgramCache
+from safeparser.parser import Parser
+
+
+def make_parser(sleep):
+    parser = Parser(program_cache=ProgramCache())
+
+    @parser.plugin_store.register
+    def fetch(x):
+        if sleep:
+            time.sleep(sleep / 1e3)
+
+        return x
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    return parser
+
+
+def make_content(statements):
+    return '\n'.join(
+        f'new{i} = [fetch(seed), count(), {i}]' if i % 10 == 0
+        else f'new{i} = [seed, {i}]'
+        for i in range(statements)
+    )
+
+
+def measure(parser, content, threads, parses):
+    def work(i):
+        parser.parse(content, env={'seed': i})
+
+    with ThreadPoolExecutor(threads) as executor:
+        # The first parse compiles and caches the program
+        executor.submit(work, 0).result()
+
+        start = time.perf_counter()
+        list(executor.map(work, range(parses)))
+
+        return time.perf_counter() - start
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument(
+        '--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16]
+    )
+    argparser.add_argument('--parses', type=int, default=2_000)
+    argparser.add_argument('--statements', type=int, default=100)
+    argparser.add_argument('--sleep', type=float, default=0)
+    args = argparser.parse_args()
+
+    parser = make_parser(args.sleep)
+    content = make_content(args.statements)
+
+    print(f'{"threads":>7} {"time":>10} {"parses/s":>10} {"speedup":>8}')
+
+    baseline = None
+
+    for threads in args.threads:
+        elapsed = measure(parser, content, threads, args.parses)
+        throughput = args.parses / elapsed
+
+        if baseline is None:
+            baseline = throughput
+
+        print(
+            f'{threads:>7} {elapsed * 1e3:>7.0f} ms {throughput:>10.0f} '
+            f'{throughput / baseline:>7.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
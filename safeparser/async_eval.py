@@ -0,0 +1,120 @@
+import ast
+import asyncio
+import functools
+import inspect
+
+from safeparser.exceptions import ParserException
+
+
+class AsyncEvaluator:
+    """
+    Evaluates validated expressions on an event loop. Plugins that return
+    awaitables (such as `async def` plugins) are awaited, and independent
+    sub-expressions, such as the elements of a list or the arguments of a call,
+    are evaluated concurrently.
+
+    If `offload` is true, synchronous plugins are run in the default executor
+    of the event loop, so that they do not block it. Plugins that take the
+    environment are always run on the event loop, since they may modify it.
+    """
+
+    def __init__(self, parser, offload=False):
+        self.parser = parser
+        self.offload = offload
+
+    async def evaluate(self, node):
+        if isinstance(node, ast.Constant):
+            return node.value
+
+        if not self.has_calls(node):
+            # There is nothing to await, so the expression is evaluated at once
+            return self.evaluate_now(node)
+
+        method = getattr(self, 'evaluate_' + type(node).__name__, None)
+
+        if method is None:
+            return self.evaluate_now(node)
+
+        return await method(node)
+
+    def has_calls(self, node):
+        return any(isinstance(child, ast.Call) for child in ast.walk(node))
+
+    def evaluate_now(self, node):
+        code = ast.Expression(body=node)
+        code.lineno = getattr(node, 'lineno', 1)
+        code.col_offset = getattr(node, 'col_offset', 0)
+
+        try:
+            return eval(
+                compile(code, '<string>', 'eval'),
+                self.parser.globals,
+                self.parser.namespace,
+            )
+        except NameError as ex:
+            raise ParserException(ex)
+
+    async def evaluate_all(self, nodes):
+        return await asyncio.gather(*(self.evaluate(node) for node in nodes))
+
+    async def evaluate_List(self, node):
+        return await self.evaluate_all(node.elts)
+
+    async def evaluate_Tuple(self, node):
+        return tuple(await self.evaluate_all(node.elts))
+
+    async def evaluate_Set(self, node):
+        return set(await self.evaluate_all(node.elts))
+
+    async def evaluate_Dict(self, node):
+        keys, values = await asyncio.gather(
+            self.evaluate_all(node.keys),
+            self.evaluate_all(node.values),
+        )
+
+        return dict(zip(keys, values))
+
+    async def evaluate_Call(self, node):
+        identifier = node.func.id
+
+        # Nested calls may also call variables, which `parse` looks up in the
+        # same namespace
+        try:
+            plugin = self.parser.namespace[identifier]
+        except KeyError:
+            raise ParserException(NameError(
+                f'name {identifier!r} is not defined'
+            ))
+
+        args, values = await asyncio.gather(
+            self.evaluate_all(node.args),
+            self.evaluate_all(kw.value for kw in node.keywords),
+        )
+
+        kwargs = {}
+        for kw, value in zip(node.keywords, values):
+            if kw.arg is None:
+                kwargs.update(value)
+            else:
+                kwargs[kw.arg] = value
+
+        if self.offload and not self.runs_on_loop(identifier, plugin):
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                None, functools.partial(plugin, *args, **kwargs)
+            )
+        else:
+            result = plugin(*args, **kwargs)
+
+        if inspect.isawaitable(result):
+            result = await result
+
+        return result
+
+    def runs_on_loop(self, identifier, plugin):
+        plugin_store = self.parser.plugin_store
+
+        return inspect.iscoroutinefunction(plugin) or (
+            plugin_store.has(identifier)
+            and plugin_store.info(identifier).wants_env
+        )
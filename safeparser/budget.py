@@ -0,0 +1,245 @@
+import ast
+import threading
+import time
+
+from safeparser.exceptions import BudgetExceeded
+from safeparser.namespace import Namespace
+from safeparser.sequences import LazySequence
+
+
+class Budget:
+    """
+    Limits on the resources that parsing some content may use. Each limit is
+    disabled when `None`:
+
+    - `max_source_bytes`: the size of the content, in UTF-8 bytes;
+    - `max_nodes` and `max_depth`: the number of nodes of the AST and how deeply
+      they are nested, checked during validation;
+    - `timeout`: the wall-clock time, in seconds, of executing the content;
+    - `plugin_timeout`: the wall-clock time, in seconds, of each plugin call;
+    - `max_value_size`: the size of each value assigned to a variable, where
+      the size of a container is its length plus the sizes of its elements, the
+      size of a string is its length, and the size of any other value is 1.
+      The lazy sequences of `safeparser.sequences` count as the containers
+      they stand for, but only the elements needed to exceed the limit are
+      computed.
+
+    Violating a limit raises `BudgetExceeded`. Plugins cannot be interrupted,
+    so when time is limited each plugin call runs in a separate thread, which
+    is abandoned if the call takes too long. Plugins that take the environment
+    are the exception, since they could modify it after the parse is over:
+    they run in the calling thread, and time limits are only checked after
+    they return. Plugin calls are not limited by `aparse`, `parse_parallel`, or
+    when evaluating the variables deferred by `parse_lazy`.
+    """
+
+    def __init__(
+        self, *,
+        max_source_bytes=None,
+        max_nodes=None,
+        max_depth=None,
+        timeout=None,
+        plugin_timeout=None,
+        max_value_size=None,
+    ):
+        self.max_source_bytes = max_source_bytes
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.plugin_timeout = plugin_timeout
+        self.max_value_size = max_value_size
+
+    def limits_time(self):
+        return self.timeout is not None or self.plugin_timeout is not None
+
+    def check_source(self, content):
+        if self.max_source_bytes is None:
+            return
+
+        if isinstance(content, bytes):
+            self.check_source_size(len(content))
+            return
+
+        # Each character takes at least one and at most four bytes, so the
+        # content only needs to be encoded when its length is inconclusive
+        if len(content) > self.max_source_bytes:
+            self.check_source_size(len(content))
+        elif len(content) * 4 > self.max_source_bytes:
+            self.check_source_size(
+                len(content.encode('utf-8', 'surrogatepass'))
+            )
+
+    def check_source_size(self, size):
+        if self.max_source_bytes is not None and size > self.max_source_bytes:
+            raise BudgetExceeded(
+                f'The content exceeds {self.max_source_bytes} bytes'
+            )
+
+    def start(self, plugin_store):
+        return BudgetTracker(self, plugin_store)
+
+
+class BudgetTracker:
+    """
+    Keeps track of the time and value limits of a budget during one parse.
+    """
+
+    def __init__(self, budget, plugin_store):
+        self.budget = budget
+        self.plugin_store = plugin_store
+
+        if budget.timeout is None:
+            self.deadline = None
+        else:
+            self.deadline = time.monotonic() + budget.timeout
+
+    def check_time(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise self.timeout_exceeded()
+
+    def timeout_exceeded(self):
+        return BudgetExceeded(f'Parsing exceeded {self.budget.timeout} seconds')
+
+    def check_value(self, identifier, value):
+        limit = self.budget.max_value_size
+
+        if limit is not None and value_size(value, limit) > limit:
+            raise BudgetExceeded(
+                f'The value of {identifier} exceeds a size of {limit}'
+            )
+
+    def call_plugin(*args, **kwargs):
+        # The arguments of the plugin may have any name, so the named arguments
+        # of this method are taken from the positional arguments
+        self, identifier, plugin, *args = args
+
+        timeout = self.timeout_for(identifier)
+
+        if timeout is None:
+            result = plugin(*args, **kwargs)
+        else:
+            result = self.call_in_thread(identifier, timeout, plugin, args, kwargs)
+
+        self.check_time()
+
+        return result
+
+    def timeout_for(self, identifier):
+        plugin_store = self.plugin_store
+
+        if plugin_store.has(identifier) and plugin_store.info(identifier).wants_env:
+            return None
+
+        timeouts = [self.budget.plugin_timeout]
+
+        if self.deadline is not None:
+            timeouts.append(max(0, self.deadline - time.monotonic()))
+
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+
+        return min(timeouts, default=None)
+
+    def call_in_thread(self, identifier, timeout, plugin, args, kwargs):
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = plugin(*args, **kwargs)
+            except BaseException as ex:
+                outcome['error'] = ex
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+
+        if thread.is_alive():
+            if timeout != self.budget.plugin_timeout:
+                # The call was cut short by the deadline of the whole parse
+                raise self.timeout_exceeded()
+
+            raise BudgetExceeded(
+                f'Plugin {identifier} exceeded {timeout:.3g} seconds'
+            )
+
+        if 'error' in outcome:
+            raise outcome['error']
+
+        return outcome['result']
+
+
+class BudgetNamespace(Namespace):
+    """
+    A namespace that checks the time and value limits of a budget whenever a
+    variable is assigned.
+    """
+
+    def __init__(self, env, plugins, tracker):
+        super().__init__(env, plugins)
+        self.tracker = tracker
+
+    def __setitem__(self, key, value):
+        self.tracker.check_value(key, value)
+        self.tracker.check_time()
+
+        super().__setitem__(key, value)
+
+
+class PluginCallWrapper(ast.NodeTransformer):
+    """
+    Replaces each call `fn(args)` with `__call_plugin__('fn', fn, args)`, so
+    that budgets can enforce time limits on plugin calls and statistics can
+    measure them.
+    """
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+
+        def located(new_node):
+            return ast.copy_location(new_node, node)
+
+        return located(ast.Call(
+            func=located(ast.Name('__call_plugin__', ast.Load())),
+            args=[located(ast.Constant(node.func.id)), node.func] + node.args,
+            keywords=node.keywords,
+        ))
+
+
+def call_plugin(*args, **kwargs):
+    """
+    Calls a plugin wrapped by `PluginCallWrapper`, without any limits.
+    """
+
+    identifier, plugin, *args = args
+
+    return plugin(*args, **kwargs)
+
+
+def value_size(value, limit):
+    """
+    Computes the size of a value, as defined in `Budget`, stopping as soon as
+    the size exceeds `limit`.
+    """
+
+    size = 0
+    stack = [value]
+
+    while stack and size <= limit:
+        item = stack.pop()
+
+        if isinstance(item, (str, bytes)):
+            size += len(item)
+        elif isinstance(item, dict):
+            size += len(item)
+
+            if size <= limit:
+                stack.extend(item.keys())
+                stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, LazySequence)):
+            size += len(item)
+
+            if size <= limit:
+                stack.extend(item)
+        else:
+            size += 1
+
+    return size
@@ -0,0 +1,274 @@
+import hashlib
+import importlib.util
+import marshal
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+_MISSING = object()
+
+
+# A validated module lowered into a single code object, along with the names of
+# the variables it assigns
+Program = namedtuple('Program', ['code', 'assigned'])
+
+
+class LRUCache:
+    """
+    A size-bounded mapping that evicts the least recently used entry when full.
+    A cache can be shared by several parsers, including parsers used from
+    different threads. A copy of a cache sent to another process starts empty.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # Cached entries may not be picklable (compiled programs, for example,
+        # cannot be pickled), so they are not sent to other processes
+        return {'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'])
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.evict()
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+
+class ProgramCache(LRUCache):
+    """
+    A cache of validated and compiled programs, which parsers use to skip
+    straight to the execution of content they have already seen.
+    """
+
+
+class DiskProgramCache(ProgramCache):
+    """
+    A program cache that also persists programs to a directory, like
+    `__pycache__`, so that a parser started later (in another process, for
+    example) skips the parsing and validation of content it has already seen.
+
+    Programs are kept in memory as with `ProgramCache`, and looked up on disk
+    when they are not in memory. Each file is named after the cache key and the
+    version of Python, and holds a header with the full key and a checksum of
+    the compiled program: files that do not match are considered stale or
+    corrupt, and are replaced. Files are written atomically, so several
+    processes can share the same directory. Failing to read or write the
+    directory never fails a parse; it only counts as a disk error.
+
+    Loading a program executes the code stored in the directory, so, as with
+    `__pycache__`, it must only be writable by trusted users.
+    """
+
+    SIGNATURE = b'safeparser-program\n'
+
+    # The names of the files of programs, for any version of Python, and of
+    # the temporary files they are written to
+    FILE_NAME = re.compile(r'[0-9a-f]{32}\.[A-Za-z0-9_-]+\.bin')
+    TEMP_FILE_NAME = re.compile(r'program-[A-Za-z0-9_]+\.tmp')
+
+    def __init__(self, directory, maxsize=128):
+        super().__init__(maxsize)
+
+        self.directory = os.fspath(directory)
+
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_errors = 0
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['maxsize'])
+
+    def get(self, key, default=None):
+        program = super().get(key, _MISSING)
+
+        if program is not _MISSING:
+            return program
+
+        program = self.load(key)
+
+        if program is None:
+            return default
+
+        with self.lock:
+            self.entries[key] = program
+            self.evict()
+
+        return program
+
+    def put(self, key, value):
+        super().put(key, value)
+        self.store(key, value)
+
+    def load(self, key):
+        header = self.header(key)
+        path = self.path(header)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.disk_misses += 1
+            return None
+        except OSError:
+            self.disk_errors += 1
+            return None
+
+        payload = data[len(header) + 32:]
+        checksum = hashlib.sha256(payload).digest()
+
+        program = None
+
+        if data[:len(header)] == header and data[len(header):][:32] == checksum:
+            try:
+                code, assigned = marshal.loads(payload)
+                program = Program(code, frozenset(assigned))
+            except (EOFError, ValueError, TypeError):
+                pass
+
+        if program is None:
+            # The file will be replaced when the program is compiled again
+            self.disk_errors += 1
+            return None
+
+        self.disk_hits += 1
+
+        return program
+
+    def store(self, key, program):
+        header = self.header(key)
+        payload = marshal.dumps((program.code, tuple(sorted(program.assigned))))
+        checksum = hashlib.sha256(payload).digest()
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            fd, temp_path = tempfile.mkstemp(
+                dir=self.directory, prefix='program-', suffix='.tmp'
+            )
+
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(header + checksum + payload)
+
+                os.replace(temp_path, self.path(header))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            self.disk_errors += 1
+
+    def header(self, key):
+        # The key identifies the content, the plugins, the parser and its
+        # settings; the magic number identifies the bytecode format
+        key_bytes = repr(tuple(stable_key(part) for part in key)).encode()
+
+        return (
+            self.SIGNATURE
+            + importlib.util.MAGIC_NUMBER
+            + len(key_bytes).to_bytes(4, 'big')
+            + key_bytes
+        )
+
+    def path(self, header):
+        name = hashlib.sha256(header).hexdigest()[:32]
+
+        return os.path.join(
+            self.directory, f'{name}.{sys.implementation.cache_tag}.bin'
+        )
+
+    def clear(self):
+        super().clear()
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        # Other files may share the directory, so only the files of the cache
+        # are removed, including the temporary files of failed writes
+        for name in names:
+            if (
+                self.FILE_NAME.fullmatch(name)
+                or self.TEMP_FILE_NAME.fullmatch(name)
+            ):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {
+            **super().stats(),
+            'disk_hits': self.disk_hits,
+            'disk_misses': self.disk_misses,
+            'disk_errors': self.disk_errors,
+        }
+
+
+def stable_key(part):
+    """
+    Converts a part of a cache key into a value whose representation is the
+    same in every process. Classes are represented by their qualified names.
+    """
+    if isinstance(part, type):
+        return f'{part.__module__}.{part.__qualname__}'
+
+    if isinstance(part, tuple):
+        return tuple(stable_key(item) for item in part)
+
+    return part
@@ -0,0 +1,259 @@
+import io
+import json
+from itertools import chain, islice
+
+from safeparser.sequences import LazySequence
+
+CONTAINERS = (list, tuple, set, frozenset, dict, LazySequence)
+SCALARS = {str, int, float, bool, complex, type(None)}
+
+
+def export_jsonl(env, file, *, default=None, chunk_size=65536, batch_size=1024):
+    """
+    Writes the variables of an environment to a file object in the JSON Lines
+    format, with one `{"name": ..., "value": ...}` object per line, in the
+    order of the environment. The file can be a text file or a binary one, in
+    which case the output is encoded as UTF-8.
+
+    Values are mapped to JSON as follows:
+
+    - strings, numbers, booleans and `None` map to themselves (with `NaN` and
+      infinite floats written as `json` does);
+    - lists and tuples map to arrays, and sets and the lazy sequences of
+      `safeparser.sequences` to arrays in iteration order;
+    - complex numbers map to `{"real": ..., "imag": ...}` objects;
+    - dictionaries map to objects, whose keys are converted to strings as
+      `json` does, or, for keys that `json` rejects (tuples, for example), to
+      their own JSON text.
+
+    Other values are passed to `default`, which must return a value that can
+    be mapped, or raise `TypeError`.
+
+    The output is written in chunks of about `chunk_size` characters, so the
+    whole JSON text is never built in memory. Values are encoded by the `json`
+    module in groups of at most `batch_size` values, counting the values
+    nested in them, and containers with more values than that, at any depth,
+    are streamed in turn.
+    """
+
+    exporter = JSONLinesExporter(file, default, chunk_size, batch_size)
+    exporter.write_variables(env.items())
+    exporter.flush()
+
+
+class JSONLinesExporter:
+
+    def __init__(self, file, default, chunk_size, batch_size):
+        self.file = file
+        self.binary = is_binary(file)
+        self.user_default = default
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+
+        self.encoder = json.JSONEncoder(
+            separators=(',', ':'), default=self.default
+        )
+
+        self.buffer = []
+        self.buffered = 0
+
+    def default(self, value):
+        if isinstance(value, (set, frozenset, LazySequence)):
+            return list(value)
+
+        if isinstance(value, complex):
+            return {'real': value.real, 'imag': value.imag}
+
+        if self.user_default is not None:
+            return self.user_default(value)
+
+        raise TypeError(
+            f'Object of type {type(value).__name__} is not JSON serializable'
+        )
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        chunk = ''.join(self.buffer)
+
+        self.buffer = []
+        self.buffered = 0
+
+        if self.binary:
+            chunk = chunk.encode('utf-8')
+
+        self.file.write(chunk)
+
+    def write_variables(self, variables):
+        for group, small in self.groups(variables):
+            for name, value in group:
+                if small:
+                    # Most variables are encoded in a single call
+                    try:
+                        text = self.encoder.encode({'name': name, 'value': value})
+                    except TypeError:
+                        pass
+                    else:
+                        self.write(text + '\n')
+                        continue
+
+                self.write('{"name":' + self.encoder.encode(name) + ',"value":')
+                self.write_value(value)
+                self.write('}\n')
+
+    def groups(self, items):
+        """
+        Splits the items into groups of consecutive items to encode together,
+        yielding each group along with whether it holds at most `batch_size`
+        values in total. Items holding more values than that are yielded on
+        their own. The number of items in a group adapts to the size of the
+        items, so that most of them are only counted once.
+        """
+        iterator = iter(items)
+        pending = []
+        size = self.batch_size
+
+        while True:
+            if len(pending) < size:
+                pending.extend(islice(iterator, size - len(pending)))
+
+            if not pending:
+                return
+
+            group = pending[:size]
+            count = self.count(group)
+
+            if count > self.batch_size and size > 1:
+                size //= 2
+                continue
+
+            del pending[:size]
+
+            if count <= self.batch_size // 2 and size < self.batch_size:
+                size *= 2
+
+            yield group, count <= self.batch_size
+
+    def count(self, values):
+        """
+        Counts the values in a list of values, including the values nested in
+        them and the keys of dictionaries, at any depth. Counting stops as soon
+        as the count exceeds `batch_size`, so only about `batch_size` values
+        are looked at.
+        """
+        limit = self.batch_size
+        count = 0
+        level = values
+
+        while level:
+            count += len(level)
+
+            if count > limit:
+                return limit + 1
+
+            # Most values are scalars, which are told apart by their type alone
+            containers = [
+                value
+                for value in level
+                if type(value) not in SCALARS and isinstance(value, CONTAINERS)
+            ]
+            level = list(islice(
+                chain.from_iterable(
+                    chain(value.keys(), value.values())
+                    if isinstance(value, dict) else value
+                    for value in containers
+                ),
+                limit - count + 1,
+            ))
+
+        return count
+
+    def write_value(self, value):
+        if self.count([value]) <= self.batch_size:
+            try:
+                self.write(self.encoder.encode(value))
+                return
+            except TypeError:
+                # Dictionaries with keys that JSON rejects, or values that
+                # `default` rejects, are looked into element by element
+                if not isinstance(value, CONTAINERS):
+                    raise
+
+        if isinstance(value, dict):
+            self.write_dict(value)
+        else:
+            self.write_sequence(value)
+
+    def write_sequence(self, value):
+        self.write('[')
+        self.write_items(value, list, self.write_value)
+        self.write(']')
+
+    def write_dict(self, value):
+        self.write('{')
+        self.write_items(
+            ((self.convert_key(key), val) for key, val in value.items()),
+            dict,
+            self.write_dict_item,
+        )
+        self.write('}')
+
+    def write_items(self, items, container, write_item):
+        first = True
+
+        for group, small in self.groups(items):
+            text = self.encode_group(container(group)) if small else None
+
+            if text is None:
+                for item in group:
+                    if not first:
+                        self.write(',')
+
+                    write_item(item)
+                    first = False
+            elif text:
+                if not first:
+                    self.write(',')
+
+                self.write(text)
+                first = False
+
+    def encode_group(self, group):
+        """
+        Returns the JSON text of the elements of the group, without the
+        enclosing brackets, or `None` if its elements must be written one by
+        one.
+        """
+        try:
+            return self.encoder.encode(group)[1:-1]
+        except TypeError:
+            return None
+
+    def write_dict_item(self, item):
+        key, value = item
+
+        self.write(self.encoder.encode(key) + ':')
+        self.write_value(value)
+
+    def convert_key(self, key):
+        # JSON objects only have string keys. Numbers, booleans and `None` are
+        # converted as `json` does, and other keys become their JSON text
+        if isinstance(key, str):
+            return key
+
+        return self.encoder.encode(key)
+
+
+def is_binary(file):
+    if isinstance(file, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+
+    # Other file objects, such as those of `tempfile`, only tell their mode
+    mode = getattr(file, 'mode', '')
+
+    return isinstance(mode, str) and 'b' in mode
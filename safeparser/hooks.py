@@ -0,0 +1,17 @@
+class NodeHook:
+    """
+    A base class for the hooks that parsers run on each node of the content
+    while validating it, given with `Parser(hooks=[...])`.
+
+    A hook defines a `visit_<NodeType>` method for each type of node it is
+    interested in (`visit_Call`, `visit_List`, `visit_Constant`, ...), which
+    receives the node before it is validated. The method can check the node,
+    raising a `ParserException` to reject the content, or transform it in
+    place, in which case the transformed node is the one validated and
+    executed. Only the node types that the validator accepts (see
+    `SafeCodeValidator`) are ever visited. Several hooks run in the order they
+    are given, and all of them run during the same walk as the validation.
+
+    Since validated programs may be cached, hooks must only depend on the
+    nodes they receive.
+    """
@@ -0,0 +1,159 @@
+import ast
+
+from safeparser.overlay import OverlayEnv
+
+# The result recorded for expression statements, which assign nothing
+_NO_VALUE = object()
+
+
+class IncrementalParser:
+    """
+    Parses successive versions of a document with a parser, reusing the
+    results of the statements that did not change since the previous version.
+
+    Each version is parsed from the environment of the parser, which is left
+    untouched, into a copy-on-write view of it (see `OverlayEnv`), which is
+    returned. Statements are compared by their syntax tree, so moving a
+    statement or changing its formatting does not change it. A statement is
+    executed again when it changed, when it reads a variable assigned by a
+    statement that was executed again, or when it comes after a statement that
+    calls plugins which take the environment. Those statements may read or
+    modify any variable, so they are always executed, and every statement after
+    them is executed too. Everything is executed again if a plugin is
+    registered (even under the name of an existing one), the plugin store is
+    cleared or replaced, or the environment of the parser is replaced; the
+    variables of that environment must not be modified between versions.
+
+    Reused values are the same objects as in the previous version, so they must
+    not be modified. After each parse, `executed` and `reused` hold the line
+    numbers of the statements that were executed and reused.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+
+        # The results of the statements of the previous version, by key, and
+        # what they were computed with
+        self.results = {}
+        self.descriptions = {}
+        self.base = None
+        self.plugins = None
+
+        self.executed = []
+        self.reused = []
+
+    def parse(self, content):
+        parser = self.parser
+        base = parser.env
+        # The version of the store changes whenever a plugin is registered,
+        # even with the same name and signature as before
+        plugins = parser.plugin_store, parser.plugin_store.version
+
+        if base is not self.base or plugins != self.plugins:
+            self.results = {}
+            self.descriptions = {}
+
+        env = OverlayEnv(base)
+        results = {}
+        descriptions = {}
+
+        self.executed = []
+        self.reused = []
+
+        with parser.execution_context(env):
+            content = parser.read_content(content)
+            root = parser.parse_root(content)
+            lines = content
+
+            if isinstance(lines, bytes):
+                # The lines only identify statements, so any decoding will do
+                lines = lines.decode('utf-8', 'surrogateescape')
+
+            lines = lines.replace('\r\n', '\n').replace('\r', '\n')
+            lines = lines.split('\n')
+
+            parser.prepare_environment()
+
+            changed = set()
+            invalidated = False
+
+            for stmt in root.body:
+                key, reads = self.describe(stmt, lines, descriptions)
+                result = self.results.get(key)
+                uses_env = parser.statement_uses_env(stmt)
+
+                if (
+                    result is None
+                    or invalidated
+                    or uses_env
+                    or not reads.isdisjoint(changed)
+                    or any(name not in parser.namespace for name in reads)
+                ):
+                    value = self.execute(stmt)
+
+                    if isinstance(stmt, ast.Assign):
+                        changed.add(stmt.targets[0].id)
+
+                    if uses_env:
+                        invalidated = True
+                    else:
+                        results[key] = value
+                else:
+                    self.reuse(stmt, result)
+                    results[key] = result
+
+        # The results of a version are only kept once it parses successfully
+        self.results = results
+        self.descriptions = descriptions
+        self.base = base
+        self.plugins = plugins
+
+        return env
+
+    def describe(self, stmt, lines, descriptions):
+        """
+        Returns the key of a statement, which is the dump of its syntax tree,
+        and the names it reads. Both are computed again only for statements
+        whose source is not the same as in the previous version.
+        """
+        source = (
+            '\n'.join(lines[stmt.lineno - 1:stmt.end_lineno]),
+            stmt.col_offset,
+            stmt.end_col_offset,
+        )
+        description = self.descriptions.get(source)
+
+        if description is None:
+            description = ast.dump(stmt), frozenset(
+                node.id
+                for node in ast.walk(stmt.value)
+                if isinstance(node, ast.Name)
+            )
+
+        descriptions[source] = description
+
+        return description
+
+    def execute(self, stmt):
+        parser = self.parser
+
+        with parser.phase('execute'):
+            parser.execute_statements(ast.Module(body=[stmt], type_ignores=[]))
+
+        self.executed.append(stmt.lineno)
+
+        if isinstance(stmt, ast.Assign):
+            return parser.env[stmt.targets[0].id]
+
+        return _NO_VALUE
+
+    def reuse(self, stmt, value):
+        parser = self.parser
+
+        if isinstance(stmt, ast.Assign):
+            identifier = stmt.targets[0].id
+
+            parser.ensure_new_variable(identifier, stmt.lineno)
+            parser.namespace[identifier] = value
+
+        self.reused.append(stmt.lineno)
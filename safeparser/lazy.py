@@ -0,0 +1,117 @@
+from collections.abc import MutableMapping
+
+from safeparser.exceptions import ParserException
+from safeparser.namespace import Namespace
+
+
+class Thunk:
+    """
+    The deferred value of a variable: the compiled expression that computes it,
+    the names that expression reads, and the line where it was assigned.
+    """
+
+    def __init__(self, code, names, lineno):
+        self.code = code
+        self.names = names
+        self.lineno = lineno
+
+    def __repr__(self):
+        return f'<Thunk from l.{self.lineno}>'
+
+
+class LazyEnv(MutableMapping):
+    """
+    An environment whose values may be thunks. A thunk is evaluated the first
+    time its variable is read, with its dependencies evaluated in turn, and the
+    resulting value replaces the thunk in the underlying dictionary. Testing
+    for a variable, iterating over the variables or measuring the environment
+    does not evaluate anything.
+    """
+
+    def __init__(self, inner, plugin_store):
+        self.inner = inner
+        self.plugin_store = plugin_store
+
+        # The variables deferred since the last call to `force`
+        self.deferred = []
+
+    def defer(self, key, code, names, lineno):
+        self.inner[key] = Thunk(code, names, lineno)
+        self.deferred.append(key)
+
+    def force(self):
+        """
+        Evaluates every deferred variable that has not been read yet, so that
+        they see the environment as it is now.
+        """
+        deferred, self.deferred = self.deferred, []
+
+        for key in deferred:
+            if self.is_deferred(key):
+                self.resolve(key)
+
+    def is_deferred(self, key):
+        return isinstance(self.inner.get(key), Thunk)
+
+    def __getitem__(self, key):
+        value = self.inner[key]
+
+        if isinstance(value, Thunk):
+            self.resolve(key)
+            value = self.inner[key]
+
+        return value
+
+    def resolve(self, key):
+        # The deferred dependencies of a thunk are evaluated before it, using an
+        # explicit stack so that long chains of variables do not exhaust the
+        # recursion limit. There are no cycles, since a thunk can only depend on
+        # variables that existed when it was created
+        stack = [key]
+
+        while stack:
+            thunk = self.inner.get(stack[-1])
+
+            if not isinstance(thunk, Thunk):
+                stack.pop()
+                continue
+
+            pending = [
+                name
+                for name in thunk.names
+                if isinstance(self.inner.get(name), Thunk)
+            ]
+
+            if pending:
+                stack.extend(pending)
+            else:
+                self.inner[stack.pop()] = self.evaluate(thunk)
+
+    def evaluate(self, thunk):
+        namespace = Namespace(self, self.plugin_store.plugins)
+
+        try:
+            return eval(thunk.code, {'__builtins__': {}}, namespace)
+        except NameError as ex:
+            raise ParserException(f'l.{thunk.lineno}: {ex}')
+
+    def __setitem__(self, key, value):
+        self.inner[key] = value
+
+    def __delitem__(self, key):
+        del self.inner[key]
+
+    def __contains__(self, key):
+        return key in self.inner
+
+    def __iter__(self):
+        return iter(self.inner)
+
+    def __reversed__(self):
+        return reversed(self.inner)
+
+    def __len__(self):
+        return len(self.inner)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.inner!r})'
@@ -0,0 +1,23 @@
+class Namespace:
+    """
+    The mapping used as the local namespace when executing code. Names are
+    looked up in the plugin store before the environment, so that a variable
+    never shadows a plugin, and assignments are written directly into the
+    environment.
+    """
+
+    def __init__(self, env, plugins):
+        self.env = env
+        self.plugins = plugins
+
+    def __getitem__(self, key):
+        if key in self.plugins:
+            return self.plugins[key]
+
+        return self.env[key]
+
+    def __setitem__(self, key, value):
+        self.env[key] = value
+
+    def __contains__(self, key):
+        return key in self.plugins or key in self.env
@@ -0,0 +1,100 @@
+from collections.abc import MutableMapping
+from itertools import chain
+
+_MISSING = object()
+
+
+class OverlayEnv(MutableMapping):
+    """
+    A copy-on-write view of a base environment. Reading a variable falls back
+    to the base, but assigning or deleting a variable only records the change
+    in the overlay, so the base is never modified and can be shared by many
+    overlays, including overlays used from different threads.
+
+    The base must not be modified while it has overlays. Only the mapping is
+    copied on write: values are shared with the base, so a plugin that mutates
+    a value in place (by appending to a list, for example) mutates it for every
+    overlay.
+
+    Variables are iterated in the order of the base, followed by the new
+    variables in the order they were assigned.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.changes = {}
+        self.deleted = set()
+
+        # The number of variables in `changes` that are not in the base
+        self.added = 0
+
+    def __getitem__(self, key):
+        value = self.changes.get(key, _MISSING)
+
+        if value is not _MISSING:
+            return value
+
+        if key in self.deleted:
+            raise KeyError(key)
+
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        if key not in self.changes and key not in self.base:
+            self.added += 1
+
+        self.changes[key] = value
+        self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key in self.changes:
+            del self.changes[key]
+
+            if key in self.base:
+                self.deleted.add(key)
+            else:
+                self.added -= 1
+        elif key in self.base and key not in self.deleted:
+            self.deleted.add(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.changes or (
+            key not in self.deleted and key in self.base
+        )
+
+    def __iter__(self):
+        return chain(
+            (key for key in self.base if key not in self.deleted),
+            self.added_keys(self.changes),
+        )
+
+    def __reversed__(self):
+        try:
+            base_keys = reversed(self.base)
+        except TypeError:
+            # Not every mapping can be iterated in reverse
+            base_keys = reversed(list(self.base))
+
+        return chain(
+            self.added_keys(reversed(self.changes)),
+            (key for key in base_keys if key not in self.deleted),
+        )
+
+    def added_keys(self, keys):
+        if not self.added:
+            return ()
+
+        return (key for key in keys if key not in self.base)
+
+    def clear(self):
+        self.changes.clear()
+        self.deleted = set(self.base)
+        self.added = 0
+
+    def __len__(self):
+        return len(self.base) - len(self.deleted) + self.added
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
@@ -1,83 +1,325 @@
 import ast
+import contextlib
+import contextvars
+import copy
+import functools
+import hashlib
 import inspect
-
+import io
+import multiprocessing
+import tokenize
+
+from safeparser.async_eval import AsyncEvaluator
+from safeparser.budget import BudgetNamespace, PluginCallWrapper, call_plugin
+from safeparser.cache import Program
+from safeparser.exceptions import BudgetExceeded, ParserException
+from safeparser.lazy import LazyEnv
+from safeparser.namespace import Namespace
+from safeparser.overlay import OverlayEnv
 from safeparser.plugins import PluginStore
 from safeparser.safe_env import SafeEnv
+from safeparser.scheduler import Scheduler
+from safeparser.streaming import iter_statements
+
+
+# The phase used when a parser does not collect statistics
+NO_PHASE = contextlib.nullcontext()
+
+
+# The execution contexts of the parses running in the current thread (or
+# asyncio task), by the id of their parser. The dictionary is replaced, never
+# modified, whenever a parse starts or ends
+CONTEXTS = contextvars.ContextVar('safeparser_contexts', default={})
+
+
+class ParseContext:
+    """
+    The state of a single call that parses content: the environment it
+    assigns variables into and the namespaces it executes the content with.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.globals = None
+        self.namespace = None
+        self.env_view = None
+
+
+def runs_in_context(method):
+    """
+    Runs a parsing method in its own execution context, whose environment is
+    given by the `env` keyword argument or, by default, is the environment of
+    the parser. The context of a generator is only active while the generator
+    runs, so that it does not leak into the code consuming it.
+    """
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def run(self, *args, env=None, **kwargs):
+            return self.run_generator(method(self, *args, **kwargs), env)
+    elif inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def run(self, *args, env=None, **kwargs):
+            with self.execution_context(env):
+                return await method(self, *args, **kwargs)
+    else:
+        @functools.wraps(method)
+        def run(self, *args, env=None, **kwargs):
+            with self.execution_context(env):
+                return method(self, *args, **kwargs)
 
+    return run
 
-class ParserException(Exception):
-    pass
+
+# The parser used by the processes of a pool started by `Parser.parse_many`
+worker_parser = None
+
+
+def init_worker(parser):
+    global worker_parser
+    worker_parser = parser
+
+
+def parse_in_worker(task):
+    index, content = task
+
+    # Each input starts from its own copy of the base environment
+    env = copy.deepcopy(worker_parser.env)
+
+    try:
+        return index, worker_parser.parse(content, env=env)
+    except ParserException as ex:
+        return index, ex
 
 
 class EnvironmentInjector(ast.NodeVisitor):
+    """
+    Passes the environment to the calls of plugins that take it. The validator
+    already does this while validating; walking a tree with an injector is
+    only needed for the calls that `process_root` or `process_stmt` may have
+    added afterwards, and calls that were already injected are left alone.
+    """
 
     def __init__(self, plugin_store):
         self.plugin_store = plugin_store
+        self.injected = False
 
     def visit_Call(self, node):
+        # Plugins may be called in the arguments of other plugins
+        self.generic_visit(node)
+
         identifier = node.func.id
 
-        if not self.plugin_store.has(identifier):
+        if self.plugin_store.has(identifier):
+            self.inject(node, self.plugin_store.info(identifier))
+
+    def inject(self, node, info):
+        if not info.wants_env:
             return
 
-        plugin = self.plugin_store.get(identifier)
+        if not any(is_env_keyword(kw) for kw in node.keywords):
+            env_node = ast.copy_location(ast.Name('__env__', ast.Load()), node)
+
+            node.keywords.append(
+                ast.copy_location(ast.keyword(arg='env', value=env_node), node)
+            )
 
-        if not callable(plugin):
+        self.injected = True
+
+
+def is_env_keyword(keyword):
+    return (
+        keyword.arg == 'env'
+        and isinstance(keyword.value, ast.Name)
+        and keyword.value.id == '__env__'
+    )
+
+
+class SafeCodeValidator:
+    """
+    Rejects any content that is not a sequence of assignments to a single
+    variable and of plugin calls, where values are built from constants
+    (numbers, strings, booleans and `None`), variables, plugin calls, lists,
+    tuples, sets and dictionaries.
+
+    The tree is walked with an explicit stack, rather than recursively, so
+    that deeply nested values are validated (or rejected by a budget) instead
+    of exhausting the recursion limit. Each node type is dispatched through a
+    table of handlers, which check the node and return the children that must
+    be validated in turn.
+
+    The same walk prepares the tree for execution: the environment is passed
+    to the calls of plugins that take it, and each statement is annotated with
+    `uses_env`, telling whether it calls such plugins. It also runs the node
+    hooks (see `NodeHook`) on each node, before the node is validated.
+    """
+
+    # The types of constants that can be written
+    CONSTANT_TYPES = (int, float, complex, str, type(None))
+
+    HANDLERS = {
+        ast.Module: 'visit_Module',
+        ast.Expr: 'visit_Expr',
+        ast.Assign: 'visit_Assign',
+        ast.Call: 'visit_Call',
+        ast.List: 'visit_List',
+        ast.Tuple: 'visit_Tuple',
+        ast.Set: 'visit_Set',
+        ast.Dict: 'visit_Dict',
+        ast.Constant: 'visit_Constant',
+        ast.Name: 'visit_Name',
+    }
+
+    def __init__(self, plugin_store, budget=None, hooks=()):
+        self.plugin_store = plugin_store
+        self.budget = budget
+        self.nodes = 0
+
+        self.injector = EnvironmentInjector(plugin_store)
+        self.statement = None
+
+        self.handlers = {
+            node_type: getattr(self, name)
+            for node_type, name in self.HANDLERS.items()
+        }
+
+        for node_type, handler in self.handlers.items():
+            methods = [
+                getattr(hook, 'visit_' + node_type.__name__)
+                for hook in hooks
+                if hasattr(hook, 'visit_' + node_type.__name__)
+            ]
+
+            if methods:
+                self.handlers[node_type] = with_hooks(methods, handler)
+
+        # Constants are only checked without their handler if no hook visits
+        # them
+        self.inline_constants = (
+            self.handlers[ast.Constant] == self.visit_Constant
+        )
+
+    def visit(self, root):
+        if self.budget is not None:
+            self.visit_with_budget(root)
             return
 
-        kwonlyargs = inspect.getfullargspec(plugin).kwonlyargs
+        handlers = self.handlers
+        constant_types = self.CONSTANT_TYPES
+        inline_constants = self.inline_constants
+        stack = [root]
 
-        if 'env' in kwonlyargs:
-            env_node = ast.Name('__env__', ast.Load())
-            env_node.lineno = 0
-            env_node.col_offset = 0
+        while stack:
+            node = stack.pop()
+            handler = handlers.get(type(node))
 
-            node.keywords.append(
-                ast.keyword(arg='env', value=env_node)
-            )
+            if handler is None:
+                self.reject(node)
 
+            children = handler(node)
 
-class SafeCodeValidator(ast.NodeVisitor):
+            if not children:
+                continue
 
-    def __init__(self, plugin_store):
-        self.plugin_store = plugin_store
+            # Constants are the bulk of large literals, so they are checked
+            # here rather than pushed onto the stack
+            for child in reversed(children):
+                if inline_constants and type(child) is ast.Constant:
+                    if not isinstance(child.value, constant_types):
+                        self.reject(child)
+                else:
+                    stack.append(child)
+
+    def visit_with_budget(self, root):
+        handlers = self.handlers
+        stack = [(root, 1)]
+
+        while stack:
+            node, depth = stack.pop()
+
+            self.nodes += 1
+            self.check_budget(node, depth)
+
+            handler = handlers.get(type(node))
+
+            if handler is None:
+                self.reject(node)
+
+            children = handler(node)
+
+            if children:
+                stack.extend((child, depth + 1) for child in reversed(children))
+
+    def check_budget(self, node, depth):
+        max_nodes = self.budget.max_nodes
+        max_depth = self.budget.max_depth
+        lineno = getattr(node, 'lineno', 1)
+
+        if max_nodes is not None and self.nodes > max_nodes:
+            raise BudgetExceeded(
+                f'l.{lineno}: The content exceeds {max_nodes} nodes'
+            )
+
+        if max_depth is not None and depth > max_depth:
+            raise BudgetExceeded(
+                f'l.{lineno}: The content exceeds a depth of {max_depth}'
+            )
+
+    def reject(self, node):
+        raise ParserException(
+            f'l.{node.lineno}: Illegal syntax'
+        )
 
     def visit_Module(self, node):
-        for stmt in node.body:
-            self.visit(stmt)
+        return node.body
 
     def visit_Expr(self, node):
         if not isinstance(node.value, ast.Call):
-            raise ParserException(
-                f'l.{node.lineno}: Illegal syntax'
-            )
+            self.reject(node)
+
+        self.start_statement(node)
 
-        self.visit_Call(node.value)
+        return [node.value]
+
+    def start_statement(self, node):
+        self.statement = node
+        node.uses_env = False
 
     def visit_Call(self, node):
         if not isinstance(node.func, ast.Name):
+            self.reject(node)
+
+        identifier = node.func.id
+
+        self.check_name(node, identifier)
+
+        if self.plugin_store.has(identifier):
+            info = self.plugin_store.info(identifier)
+
+            if info.wants_env:
+                self.inject_env(node, info)
+
+        return node.args + [kw.value for kw in node.keywords]
+
+    def inject_env(self, node, info):
+        if any(kw.arg == 'env' for kw in node.keywords):
+            # The environment cannot be replaced by the content
             raise ParserException(
-                f'l.{node.lineno}: Illegal syntax'
+                f'l.{node.lineno}: Illegal keyword argument env for plugin {node.func.id}'
             )
 
-        for arg in node.args:
-            self.visit(arg)
+        self.injector.inject(node, info)
 
-        for kw in node.keywords:
-            self.visit(kw.value)
+        if self.statement is not None:
+            self.statement.uses_env = True
 
     def visit_Assign(self, node):
         if len(node.targets) > 1:
             # a = b = c
-            raise ParserException(
-                f'l.{node.lineno}: Illegal syntax'
-            )
+            self.reject(node)
 
         if not isinstance(node.targets[0], ast.Name):
             # a, b = c
-            raise ParserException(
-                f'l.{node.lineno}: Illegal syntax'
-            )
+            self.reject(node)
 
         identifier = node.targets[0].id
 
@@ -96,97 +338,623 @@ class SafeCodeValidator(ast.NodeVisitor):
                 f'l.{node.lineno}: Illegal assignment into double-underscore variable {identifier}'
             )
 
-        self.visit(node.value)
+        self.start_statement(node)
+
+        return [node.value]
 
     def visit_List(self, node):
-        for elt in node.elts:
-            self.visit(elt)
+        return node.elts
 
     def visit_Tuple(self, node):
-        for elt in node.elts:
-            self.visit(elt)
+        return node.elts
 
     def visit_Set(self, node):
-        for elt in node.elts:
-            self.visit(elt)
+        return node.elts
 
     def visit_Dict(self, node):
-        for key in node.keys:
-            self.visit(key)
+        if None in node.keys:
+            # {**a}
+            self.reject(node)
 
-        for val in node.values:
-            self.visit(val)
+        return node.keys + node.values
 
-    def visit_Num(self, node):
-        pass
+    def visit_Constant(self, node):
+        if not isinstance(node.value, self.CONSTANT_TYPES):
+            # Bytes and ellipses
+            self.reject(node)
 
-    def visit_NameConstant(self, node):
-        pass
+    def visit_Name(self, node):
+        self.check_name(node, node.id)
+
+    def check_name(self, node, identifier):
+        if (
+            identifier.startswith('__')
+            and identifier.endswith('__')
+            and identifier != '__env__'
+            and not self.plugin_store.has(identifier)
+        ):
+            # The internal functions of the parser live in the same namespace
+            # as the variables, so the content must not be able to name them
+            raise ParserException(
+                f'l.{node.lineno}: Illegal use of double-underscore variable {identifier}'
+            )
 
-    def visit_Str(self, node):
-        pass
 
-    def visit_Name(self, node):
-        pass
+def with_hooks(methods, handler):
+    def handle(node):
+        for method in methods:
+            method(node)
 
-    def generic_visit(self, node):
-        raise ParserException(
-            f'l.{node.lineno}: Illegal syntax'
-        )
+        return handler(node)
 
+    return handle
 
-class Parser:
 
-    def __init__(self, *, env=None, plugin_store=None):
+class Parser:
+    """
+    Parses content with the plugins of a plugin store.
+
+    A parser can be shared by several threads (or asyncio tasks) that parse
+    at the same time: the state of each call lives in an execution context of
+    its own (see `ParseContext`), and while a call runs, `self.env` is the
+    environment of that call. Each call can be given its own environment with
+    the `env` keyword argument of the parsing methods, in which case the
+    parser's environment is neither used nor modified; otherwise calls share
+    the parser's environment, and must not run at the same time. The plugins,
+    hooks and settings of a shared parser must not change while it is in use.
+    """
+
+    def __init__(
+        self, *,
+        env=None,
+        plugin_store=None,
+        program_cache=None,
+        budget=None,
+        stats=None,
+        hooks=(),
+    ):
         if env is None:
             env = {}
 
         if plugin_store is None:
             plugin_store = PluginStore()
 
-        self.env = env
+        self.default_env = env
         self.plugin_store = plugin_store
+        self.program_cache = program_cache
+        self.budget = budget
+        self.stats = stats
+        self.hooks = list(hooks)
 
+    @runs_in_context
     def parse(self, content):
         content = self.read_content(content)
 
+        if self.compiles_module():
+            root = None
+            program = self.load_program(content)
+        else:
+            root = self.parse_root(content)
+
+        # Since we're using python's eval function to actually evaluate
+        # expressions, we must ensure that no builtin python functions leak into
+        # the evaluation. Also, there are other important preparations that
+        # must be executed before actually evaluating the content
+        self.prepare_environment()
+
+        with self.phase('execute'):
+            if root is None:
+                self.execute_program(program, content)
+            else:
+                self.execute(root)
+
+        return self.env
+
+    @runs_in_context
+    async def aparse(self, content, *, offload=False):
+        """
+        Parses the content on the running event loop. Plugins may be coroutine
+        functions (or return other awaitables), which are awaited, and the
+        independent plugin calls within each statement run concurrently.
+        Statements are still executed one after the other, with the same
+        checks as `parse`, and `process_stmt` is called for each of them.
+
+        If `offload` is true, synchronous plugins run in the default executor
+        of the event loop instead of blocking it, except for plugins that take
+        the environment.
+        """
+        content = self.read_content(content)
+        root = self.parse_root(content)
+
+        evaluator = AsyncEvaluator(self, offload)
+
+        self.prepare_environment()
+
+        for stmt in root.body:
+            self.process_stmt(stmt)
+
+            if isinstance(stmt, ast.Assign):
+                identifier = stmt.targets[0].id
+                self.ensure_new_variable(identifier, stmt.lineno)
+            elif not isinstance(stmt, ast.Expr):
+                self.reject_stmt(stmt.lineno)
+
+            if isinstance(stmt.value, ast.Call):
+                self.ensure_plugin(stmt.value.func.id, stmt.lineno)
+
+            if self.reinjects_env():
+                EnvironmentInjector(self.plugin_store).visit(stmt.value)
+
+            value = await evaluator.evaluate(stmt.value)
+
+            if isinstance(stmt, ast.Assign):
+                self.namespace[identifier] = value
+
+        return self.env
+
+    @runs_in_context
+    def parse_parallel(self, content, executor):
+        """
+        Parses the content, running independent statements concurrently on the
+        given `concurrent.futures` executor (a thread or process pool). The
+        dependencies between statements are determined by the variables each
+        statement reads, and statements that call plugins which take the
+        environment wait for all the statements before them. With a process
+        pool, the plugins and the variables read by each statement must be
+        picklable.
+
+        If some statements fail, the error of the earliest one is raised once
+        the running statements finish, and the variables assigned by the
+        statements that succeeded are kept in the environment.
+        """
+        content = self.read_content(content)
+        root = self.parse_root(content)
+
+        self.prepare_environment()
+
+        Scheduler(self, executor).run(root)
+
+        return self.env
+
+    @runs_in_context
+    def parse_lazy(self, content):
+        """
+        Parses the content without evaluating the assignments. Instead, each
+        variable is evaluated, along with the variables it depends on, the first
+        time it is read. Expression statements and statements that call plugins
+        which take the environment have side effects, so they are still executed
+        in order, as with `parse`. Since those plugins may read or change any
+        variable, the variables deferred before them are evaluated first.
+
+        After this, the environment of the parser is a `LazyEnv` wrapping the
+        original one, and is also the returned value.
+        """
+        content = self.read_content(content)
+        root = self.parse_root(content)
+
+        if not isinstance(self.env, LazyEnv):
+            self.env = LazyEnv(self.env, self.plugin_store)
+
+        self.prepare_environment()
+
+        for stmt in root.body:
+            self.process_stmt(stmt)
+
+            if not isinstance(stmt, (ast.Assign, ast.Expr)):
+                self.reject_stmt(stmt.lineno)
+
+            if not self.uses_env(stmt.value):
+                if isinstance(stmt, ast.Assign):
+                    self.defer_assign(stmt)
+                else:
+                    self.execute_expr(stmt)
+
+                continue
+
+            # Plugins that take the environment may read or change any
+            # variable, so the deferred ones are evaluated first, as they
+            # would have been by `parse`
+            self.env.force()
+
+            if isinstance(stmt, ast.Assign):
+                self.execute_assign(stmt)
+            else:
+                self.execute_expr(stmt)
+
+        return self.env
+
+    def defer_assign(self, stmt):
+        identifier = stmt.targets[0].id
+
+        self.ensure_new_variable(identifier, stmt.lineno)
+
+        if isinstance(stmt.value, ast.Call):
+            self.ensure_plugin(stmt.value.func.id, stmt.lineno)
+
+        names = {
+            node.id
+            for node in ast.walk(stmt.value)
+            if isinstance(node, ast.Name)
+        }
+
+        # Names that are not defined yet would only be detected when the
+        # variable is read, so they are reported now, as `parse` would
+        for name in names:
+            if name not in self.namespace:
+                raise ParserException(
+                    f'l.{stmt.lineno}: name {name!r} is not defined'
+                )
+
+        code = self.compile_expr(stmt.value)
+
+        self.env.defer(identifier, code, names, stmt.lineno)
+
+    def uses_env(self, expr):
+        """
+        Whether evaluating the expression calls plugins that take the
+        environment, which may read or modify any variable.
+        """
+        return any(
+            isinstance(node, ast.Call)
+            and self.plugin_store.has(node.func.id)
+            and self.plugin_store.info(node.func.id).wants_env
+            for node in ast.walk(expr)
+        )
+
+    @runs_in_context
+    def parse_stream(self, content):
+        """
+        Parses a file object, text or binary, (or a string) one top-level
+        statement at a time. Each statement is read, validated, processed and
+        executed as soon as it is complete, and then discarded, so that the
+        memory needed is bounded by the largest statement rather than by the
+        whole input. Binary files are decoded as python source files are.
+
+        Unlike `parse`, an invalid statement is only detected once all the
+        statements before it have been executed, and `process_root` is called
+        with a separate module for each top-level statement.
+        """
+        if isinstance(content, str):
+            content = io.StringIO(content)
+
         try:
-            root = ast.parse(content, filename='')
-        except SyntaxError as e:
+            readline = content.readline
+        except AttributeError:
+            raise ParserException(
+                f'Cannot read the contents of a {type(content)} variable'
+            )
+
+        self.prepare_environment()
+
+        size = 0
+
+        try:
+            for lineno, source in iter_statements(readline):
+                if self.budget is not None:
+                    size += len(source.encode('utf-8', 'surrogatepass'))
+                    self.budget.check_source_size(size)
+
+                root = self.parse_root(source, lineno)
+
+                with self.phase('execute'):
+                    self.execute(root)
+        except (tokenize.TokenError, SyntaxError, UnicodeDecodeError) as e:
+            # Binary files whose encoding is unknown or wrong are rejected by
+            # `tokenize` with syntax or decoding errors
             raise ParserException(e)
 
-        SafeCodeValidator(self.plugin_store).visit(root)
+        return self.env
 
-        self.process_root(root)
+    @runs_in_context
+    def iter_parse(self, content, *, release=False):
+        """
+        Parses the content, yielding a `(name, value, lineno)` tuple as soon as
+        each assignment has been executed, so that the results can be used
+        while the rest of the content is still being executed. The content is
+        validated as a whole before the first statement is executed, as with
+        `parse`.
+
+        If `release` is true, each assigned variable is removed from the
+        environment once it has been yielded and no later statement refers to
+        it, so that the environment does not hold every result at once.
+        Statements that call plugins which take the environment may read any
+        variable, so no variable is removed before them.
+        """
+        content = self.read_content(content)
+        root = self.parse_root(content)
 
-        # Since we're using python's eval function to actually evaluate
-        # expressions, we must ensure that no builtin python functions leak into
-        # the environment. Also, there are other important preparations that
-        # must be executed to the environment before actually evaluating the
-        # content
         self.prepare_environment()
 
+        releases = self.find_releases(root) if release else {}
+
+        for index, stmt in enumerate(root.body):
+            with self.phase('execute'):
+                self.execute_statements(
+                    ast.Module(body=[stmt], type_ignores=[])
+                )
+
+            if isinstance(stmt, ast.Assign):
+                identifier = stmt.targets[0].id
+                yield identifier, self.env[identifier], stmt.lineno
+
+            for identifier in releases.get(index, ()):
+                self.env.pop(identifier, None)
+
+    def find_releases(self, root):
+        """
+        Maps the index of each statement to the variables assigned by the
+        content that can be removed from the environment after it executes.
+        """
+        last_reference = {}
+        last_env_use = -1
+
+        for index, stmt in enumerate(root.body):
+            for node in ast.walk(stmt):
+                if isinstance(node, ast.Name):
+                    last_reference[node.id] = index
+
+            if self.statement_uses_env(stmt):
+                last_env_use = index
+
+        if self.processes_statements():
+            # Processing a statement may add calls to plugins that take the
+            # environment, so variables are only removed at the end
+            last_env_use = len(root.body) - 1
+
+        assigned = {
+            stmt.targets[0].id
+            for stmt in root.body
+            if isinstance(stmt, ast.Assign)
+            and isinstance(stmt.targets[0], ast.Name)
+            and stmt.targets[0].id not in self.env
+        }
+
+        releases = {}
+
+        for identifier in assigned:
+            index = max(last_reference[identifier], last_env_use)
+            releases.setdefault(index, []).append(identifier)
+
+        return releases
+
+    def parse_many(self, inputs, *, workers=None, chunksize=1, ordered=True):
+        """
+        Parses independent inputs in a pool of `workers` processes (by default,
+        as many as there are CPUs). Each input is parsed from its own copy of
+        this parser's environment, which is left untouched. The parser, along
+        with its plugin store, is sent to each process only once, which means
+        that it must be picklable.
+
+        This is a generator. When `ordered` is true, it yields the resulting
+        environments in the order of the inputs; otherwise it yields `(index,
+        env)` pairs as soon as they are available. Inputs that fail to parse
+        produce the `ParserException` instead of an environment. Inputs are
+        sent to the processes in chunks of `chunksize` inputs.
+        """
+        tasks = enumerate(self.read_content(content) for content in inputs)
+
+        with multiprocessing.Pool(
+            workers, initializer=init_worker, initargs=(self,)
+        ) as pool:
+            if ordered:
+                for _, result in pool.imap(parse_in_worker, tasks, chunksize):
+                    yield result
+            else:
+                yield from pool.imap_unordered(
+                    parse_in_worker, tasks, chunksize
+                )
+
+    def fork(self):
+        """
+        Returns a parser that shares the plugins and the settings of this one,
+        and whose environment is a copy-on-write view of this parser's
+        environment (see `OverlayEnv`). Parsing with the fork leaves this
+        parser's environment untouched, without copying it, so many forks can
+        be created from the same base, as long as the base is not modified
+        while they are in use.
+        """
+        fork = copy.copy(self)
+        fork.env = OverlayEnv(self.env)
+
+        return fork
+
+    def __getstate__(self):
+        # The view of the environment is rebuilt when needed
+        state = self.__dict__.copy()
+        state.pop('env_view', None)
+
+        return state
+
+    @contextlib.contextmanager
+    def execution_context(self, env=None):
+        shared = env is None
+        context = ParseContext(self.env if shared else env)
+
         try:
-            self.execute(root)
+            with self.activate(context):
+                yield context
         finally:
-            # We do not want to report back the internal variables in the
-            # environment; as such, we remove them here before the user has the
-            # possibility of examining the environment
-            self.strip_environment()
+            if shared:
+                # A call may replace the environment (as `parse_lazy` does),
+                # which then replaces the environment of the parser
+                self.env = context.env
 
-        return self.env
+    @contextlib.contextmanager
+    def activate(self, context):
+        token = CONTEXTS.set({**CONTEXTS.get(), id(self): context})
+
+        try:
+            yield
+        finally:
+            CONTEXTS.reset(token)
+
+    def run_generator(self, generator, env):
+        shared = env is None
+        context = ParseContext(self.env if shared else env)
+
+        def run():
+            try:
+                while True:
+                    with self.activate(context):
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+
+                    yield item
+            finally:
+                with self.activate(context):
+                    generator.close()
+
+                if shared:
+                    self.env = context.env
+
+        return run()
+
+    def current_context(self):
+        context = CONTEXTS.get().get(id(self))
+
+        if context is None:
+            raise AttributeError(
+                'The execution context of a parser only exists while parsing'
+            )
+
+        return context
+
+    @property
+    def env(self):
+        context = CONTEXTS.get().get(id(self))
+
+        if context is None:
+            return self.default_env
+
+        return context.env
+
+    @env.setter
+    def env(self, env):
+        context = CONTEXTS.get().get(id(self))
+
+        if context is None:
+            self.default_env = env
+        else:
+            context.env = env
+
+    @property
+    def globals(self):
+        return self.current_context().globals
+
+    @property
+    def namespace(self):
+        return self.current_context().namespace
 
     def read_content(self, content):
-        if isinstance(content, str):
-            return content
+        with self.phase('read'):
+            if not isinstance(content, str):
+                content = self.read_file(content)
+
+            if self.budget is not None:
+                self.budget.check_source(content)
+
+        return content
+
+    def read_file(self, content):
+        if self.budget is None or self.budget.max_source_bytes is None:
+            size = -1
+        else:
+            # There is no need to read more than what exceeds the budget
+            size = self.budget.max_source_bytes + 1
 
         try:
-            return content.read()
+            return content.read(size)
         except:
             raise ParserException(
                 f'Cannot read the contents of a {type(content)} variable'
             )
 
+    def parse_root(self, content, lineno=1):
+        """
+        Parses, validates and processes the content, whose first line is line
+        `lineno` of the input.
+        """
+        try:
+            with self.phase('parse'):
+                root = ast.parse(content, filename='')
+        except SyntaxError as e:
+            if e.lineno is not None:
+                e.lineno += lineno - 1
+
+            raise ParserException(e)
+
+        if lineno > 1:
+            ast.increment_lineno(root, lineno - 1)
+
+        with self.phase('validate'):
+            SafeCodeValidator(
+                self.plugin_store, self.budget, self.hooks
+            ).visit(root)
+
+        with self.phase('process_root'):
+            self.process_root(root)
+
+        return root
+
+    def load_program(self, content):
+        """
+        Returns the compiled program for the given content. If the parser has a
+        program cache, programs are looked up by the hash of the content, the
+        fingerprint of the plugin store, the class of the parser, the classes
+        of its hooks and the limits of its budget, which means that
+        `process_root` and the hooks must only depend on the AST they receive.
+        """
+        if self.program_cache is None:
+            return self.compile_program(self.parse_root(content))
+
+        key = self.program_key(content)
+        program = self.program_cache.get(key)
+
+        if program is None:
+            program = self.compile_program(self.parse_root(content))
+            self.program_cache.put(key, program)
+
+        return program
+
+    def program_key(self, content):
+        # Binary files are read as bytes, which are hashed as they are
+        if isinstance(content, str):
+            content = content.encode('utf-8', 'surrogatepass')
+
+        digest = hashlib.sha256(content).hexdigest()
+
+        return (
+            digest,
+            self.plugin_store.fingerprint(),
+            type(self),
+            tuple(type(hook) for hook in self.hooks),
+            self.limits_time(),
+            self.validation_limits(),
+            self.stats is not None,
+        )
+
+    def validation_limits(self):
+        # Validation is skipped for cached programs, so a program validated
+        # against some limits cannot be reused under other ones
+        if self.budget is None:
+            return None
+
+        return self.budget.max_nodes, self.budget.max_depth
+
+    def compile_program(self, root):
+        assigned = frozenset(
+            stmt.targets[0].id
+            for stmt in root.body
+            if isinstance(stmt, ast.Assign)
+        )
+
+        with self.phase('compile'):
+            code = self.compile_module(root)
+
+        return Program(code, assigned)
+
     def process_root(self, root):
         """
         This function is meant to be implemented by a subclass. It can be used
@@ -204,61 +972,307 @@ class Parser:
         pass
 
     def prepare_environment(self):
-        self.env['__builtins__'] = {}
-        self.env['__env__'] = SafeEnv(self.env)
+        # The namespaces used to evaluate code are created once per parse. The
+        # local namespace is a live view over the environment and the plugins,
+        # so it does not need to be updated as variables are assigned. The
+        # internal names live in the global namespace, so the environment is
+        # never modified to hold them
+        context = self.current_context()
+
+        context.globals = {
+            '__builtins__': {},
+            '__env__': self.safe_env(),
+            '__new_variable__': self.ensure_new_variable,
+            '__plugin__': self.ensure_plugin,
+            '__illegal__': self.reject_stmt,
+        }
+        if self.budget is None:
+            context.namespace = Namespace(self.env, self.plugin_store.plugins)
+            plugin_caller = call_plugin
+        else:
+            tracker = self.budget.start(self.plugin_store)
+
+            context.namespace = BudgetNamespace(
+                self.env, self.plugin_store.plugins, tracker
+            )
+            plugin_caller = tracker.call_plugin
 
-    def strip_environment(self):
-        del self.env['__builtins__']
-        del self.env['__env__']
+        if self.stats is not None:
+            context.globals['__statement__'] = self.stats.start_statement
+            plugin_caller = self.stats.timed(plugin_caller)
+
+        context.globals['__call_plugin__'] = plugin_caller
+
+    def safe_env(self):
+        """
+        The view of the environment given to plugins that take it. The view of
+        the parser's environment is kept between parses, since it tracks the
+        hidden keys of the environment incrementally, while the view of an
+        environment given to a single call only lasts for that call.
+        """
+        env = self.env
+        holder = self if env is self.default_env else self.current_context()
+        safe_env = getattr(holder, 'env_view', None)
+
+        if safe_env is None or safe_env.inner is not env:
+            safe_env = holder.env_view = SafeEnv(env)
+        elif safe_env.hidden_keys:
+            # Hidden keys may have been removed from the environment without
+            # changing its length, so they are looked for again
+            safe_env.refresh()
+
+        return safe_env
 
     def execute(self, root):
+        if self.compiles_module():
+            self.execute_module(root)
+        else:
+            self.execute_statements(root)
+
+    def compiles_module(self):
+        """
+        Whether the whole module can be compiled into a single code object.
+        This is only the case when none of the per-statement methods have been
+        overridden by a subclass, as those methods expect to be called once for
+        each statement, with the environment reflecting all previous statements.
+        Overriding `execute` or `prepare_environment` also disables it, so that
+        `parse` calls them as it always did.
+        """
+        cls = type(self)
+
+        return all(
+            getattr(cls, name) is getattr(Parser, name)
+            for name in self.STATEMENT_METHODS
+        )
+
+    STATEMENT_METHODS = (
+        'execute',
+        'prepare_environment',
+        'process_stmt',
+        'execute_assign',
+        'execute_expr',
+        'evaluate_expr',
+        'compile_expr',
+    )
+
+    def execute_program(self, program, content):
+        if any(name in self.env for name in program.assigned):
+            # The program was compiled without checking for existing variables,
+            # so it must be recompiled for this environment. This only happens
+            # when the content is about to fail
+            self.execute_module(self.parse_root(content))
+        else:
+            self.execute_code(program.code)
+
+    def execute_module(self, root):
+        existing = {
+            stmt.targets[0].id
+            for stmt in root.body
+            if isinstance(stmt, ast.Assign) and stmt.targets[0].id in self.env
+        }
+
+        with self.phase('compile'):
+            code = self.compile_module(root, existing)
+
+        self.execute_code(code)
+
+    def execute_code(self, code):
+        try:
+            exec(code, self.globals, self.namespace)
+        except NameError as ex:
+            raise ParserException(ex)
+        finally:
+            if self.stats is not None:
+                self.stats.end_statement()
+
+    def compile_module(self, root, existing=()):
+        """
+        Lower the module into a single code object.
+
+        The checks that `execute_assign` and `evaluate_expr` perform are
+        inserted before the statements where they can fail, so that errors are
+        raised at the same point of the execution and with the same line
+        numbers. An assignment only needs to be checked if its variable is one
+        of the `existing` ones, if it was assigned before in the module, or if
+        a plugin that takes the environment may have created it. When the
+        parser collects statistics, the start of each statement is marked too.
+        """
+        body = []
+        assigned = set(existing)
+        injected = False
+
         for stmt in root.body:
-            self.process_stmt(stmt)
-            
+            if self.stats is not None:
+                body.append(self.lower_check(stmt, '__statement__'))
+
             if isinstance(stmt, ast.Assign):
-                self.execute_assign(stmt)
-            elif isinstance(stmt, ast.Expr):
-                self.execute_expr(stmt)
-            else:
-                raise ParserException(
-                    f'l.{stmt.lineno}: Illegal syntax'
-                )
+                identifier = stmt.targets[0].id
+
+                if injected or identifier in assigned:
+                    body.append(self.lower_check(
+                        stmt, '__new_variable__', identifier
+                    ))
+
+                assigned.add(identifier)
+            elif not isinstance(stmt, ast.Expr):
+                body.append(self.lower_check(stmt, '__illegal__'))
+                break
+
+            if isinstance(stmt.value, ast.Call):
+                if not self.plugin_store.has(stmt.value.func.id):
+                    body.append(self.lower_check(
+                        stmt, '__plugin__', stmt.value.func.id
+                    ))
+                    break
+
+            if self.statement_uses_env(stmt):
+                injected = True
+
+            if self.wraps_calls():
+                stmt.value = PluginCallWrapper().visit(stmt.value)
+
+            body.append(stmt)
+
+        code = ast.Module(body=body, type_ignores=[])
+
+        return compile(code, '<string>', 'exec')
+
+    def statement_uses_env(self, stmt):
+        if not self.reinjects_env() and hasattr(stmt, 'uses_env'):
+            return stmt.uses_env
+
+        injector = EnvironmentInjector(self.plugin_store)
+        injector.visit(stmt.value)
+
+        return injector.injected
+
+    def processes_statements(self):
+        """
+        Whether `process_stmt` has been overridden, in which case statements
+        may change, and may call plugins that take the environment, once they
+        have been processed.
+        """
+        return type(self).process_stmt is not Parser.process_stmt
+
+    def reinjects_env(self):
+        """
+        Whether the environment must be passed again to plugin calls before
+        executing them. The validator already passes it to every call in the
+        content, so this is only the case when `process_root` or
+        `process_stmt` have been overridden, as they may add calls.
+        """
+        cls = type(self)
+
+        return (
+            cls.process_root is not Parser.process_root
+            or cls.process_stmt is not Parser.process_stmt
+        )
+
+    def lower_check(self, stmt, check, *args):
+        # The generated nodes are located explicitly, since running
+        # `ast.fix_missing_locations` would walk the whole module again
+        def located(node):
+            return ast.copy_location(node, stmt)
+
+        call = located(ast.Call(
+            func=located(ast.Name(check, ast.Load())),
+            args=[located(ast.Constant(arg)) for arg in args + (stmt.lineno,)],
+            keywords=[],
+        ))
+
+        return located(ast.Expr(call))
+
+    def execute_statements(self, root):
+        stats = self.stats
+
+        try:
+            for stmt in root.body:
+                if stats is not None:
+                    stats.start_statement(stmt.lineno)
+
+                self.process_stmt(stmt)
+
+                if isinstance(stmt, ast.Assign):
+                    self.execute_assign(stmt)
+                elif isinstance(stmt, ast.Expr):
+                    self.execute_expr(stmt)
+                else:
+                    self.reject_stmt(stmt.lineno)
+        finally:
+            if stats is not None:
+                stats.end_statement()
 
     def execute_assign(self, stmt):
         identifier = stmt.targets[0].id
 
-        if identifier in self.env:
-            # Disallow overwriting variables
-            raise ParserException(
-                f'l.{stmt.lineno}: Illegal assignment into existing variable {identifier}'
-            )
+        self.ensure_new_variable(identifier, stmt.lineno)
 
-        self.env[identifier] = self.evaluate_expr(stmt.value)
+        self.namespace[identifier] = self.evaluate_expr(stmt.value)
 
     def execute_expr(self, stmt):
         return self.evaluate_expr(stmt.value)
 
     def evaluate_expr(self, expr):
         if isinstance(expr, ast.Call):
-            if not self.plugin_store.has(expr.func.id):
-                raise ParserException(
-                    f'l.{expr.lineno}: Unknown plugin {expr.func.id}'
-                )
+            self.ensure_plugin(expr.func.id, expr.lineno)
 
-        try:
-            globals = {}
-            globals.update(self.env)
-            globals.update(self.plugin_store.plugins)
+        if self.wraps_calls():
+            # Calls are wrapped after injecting the environment, since the
+            # wrapped calls are no longer calls to the plugins themselves
+            if self.reinjects_env():
+                EnvironmentInjector(self.plugin_store).visit(expr)
 
-            return eval(self.compile_expr(expr), globals)
+            expr = PluginCallWrapper().visit(expr)
+
+        try:
+            return eval(self.compile_expr(expr), self.globals, self.namespace)
         except NameError as ex:
             raise ParserException(ex)
 
     def compile_expr(self, expr):
-        EnvironmentInjector(self.plugin_store).visit(expr)
+        if self.reinjects_env():
+            EnvironmentInjector(self.plugin_store).visit(expr)
 
         code = ast.Expression(body=expr)
         code.lineno = expr.lineno
         code.col_offset = expr.col_offset
 
         return compile(code, '<string>', 'eval')
+
+    def limits_time(self):
+        return self.budget is not None and self.budget.limits_time()
+
+    def wraps_calls(self):
+        """
+        Whether plugin calls go through `__call_plugin__`, which is the case
+        when time is limited or statistics are collected.
+        """
+        return self.limits_time() or self.stats is not None
+
+    def phase(self, name):
+        """
+        A context manager measuring a phase of parsing, if the parser collects
+        statistics.
+        """
+        if self.stats is None:
+            return NO_PHASE
+
+        return self.stats.phase(name)
+
+    def ensure_new_variable(self, identifier, lineno):
+        if identifier in self.env:
+            # Disallow overwriting variables
+            raise ParserException(
+                f'l.{lineno}: Illegal assignment into existing variable {identifier}'
+            )
+
+    def ensure_plugin(self, identifier, lineno):
+        if not self.plugin_store.has(identifier):
+            raise ParserException(
+                f'l.{lineno}: Unknown plugin {identifier}'
+            )
+
+    def reject_stmt(self, lineno):
+        raise ParserException(
+            f'l.{lineno}: Illegal syntax'
+        )
@@ -1,15 +1,247 @@
+import functools
+import hashlib
+import importlib
+import importlib.metadata
+import inspect
+from collections import namedtuple
+
+from safeparser.cache import LRUCache
+
+PluginInfo = namedtuple('PluginInfo', ['callable', 'wants_env'])
+
+
+def inspect_plugin(plugin):
+    """
+    Computes the metadata of a plugin: whether it is callable, and whether it
+    accepts the environment as the keyword-only argument `env`.
+    """
+
+    if not callable(plugin):
+        return PluginInfo(callable=False, wants_env=False)
+
+    # `getfullargspec` does not follow `__wrapped__`, so plugins decorated
+    # with `functools.wraps` are described by the signature of the wrapper,
+    # which is the one that is called
+    try:
+        kwonlyargs = inspect.getfullargspec(plugin).kwonlyargs
+    except TypeError:
+        return PluginInfo(callable=True, wants_env=False)
+
+    return PluginInfo(callable=True, wants_env='env' in kwonlyargs)
+
+
+_MISSING = object()
+
+
+def canonicalize(value):
+    """
+    Converts a value into a hashable key that identifies it. Lists, tuples,
+    sets and dicts are converted recursively and tagged with their type, as are
+    scalars, so that, for example, `[1]`, `(1,)` and `[True]` produce different
+    keys. Raises `TypeError` for values that cannot be converted.
+    """
+
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(canonicalize(item) for item in value)
+
+    if isinstance(value, (set, frozenset)):
+        return type(value), frozenset(canonicalize(item) for item in value)
+
+    if isinstance(value, dict):
+        return dict, frozenset(
+            (canonicalize(key), canonicalize(item))
+            for key, item in value.items()
+        )
+
+    hash(value)
+
+    return type(value), value
+
+
+class MemoizedPlugin:
+    """
+    Wraps a pure plugin, caching its results in a size-bounded LRU cache keyed
+    by its arguments. Calls whose arguments cannot be canonicalized are not
+    cached. Cached results are shared by every call with the same arguments, so
+    they must not be modified.
+    """
+
+    def __init__(self, plugin, maxsize=128):
+        functools.update_wrapper(self, plugin, updated=())
+
+        self.plugin = plugin
+        self.cache = LRUCache(maxsize)
+
+    def __call__(self, *args, **kwargs):
+        try:
+            key = canonicalize((args, kwargs))
+        except TypeError:
+            return self.plugin(*args, **kwargs)
+
+        result = self.cache.get(key, _MISSING)
+
+        if result is _MISSING:
+            result = self.plugin(*args, **kwargs)
+            self.cache.put(key, result)
+
+        return result
+
+    def stats(self):
+        return self.cache.stats()
+
+    def clear(self):
+        self.cache.clear()
+
+    def resize(self, maxsize):
+        self.cache.resize(maxsize)
+
+
+def make_pure(plugin, name, maxsize):
+    if inspect_plugin(plugin).wants_env:
+        raise ValueError(
+            f'Plugin {name} takes the environment and cannot be pure'
+        )
+
+    return MemoizedPlugin(plugin, maxsize)
+
+
+def entry_points(group):
+    eps = importlib.metadata.entry_points()
+
+    if hasattr(eps, 'select'):
+        return eps.select(group=group)
+
+    # Python < 3.10
+    return eps.get(group, [])
+
+
+class LazyPlugin:
+    """
+    A plugin that is not loaded yet. The target is either a `'module:attr'`
+    string, where `attr` can be a dotted path, or an `importlib.metadata`
+    entry point.
+    """
+
+    def __init__(self, name, target, pure=False, maxsize=128):
+        self.name = name
+        self.target = target
+        self.pure = pure
+        self.maxsize = maxsize
+
+    def describe(self):
+        if isinstance(self.target, str):
+            return self.target
+
+        return self.target.value
+
+    def load(self):
+        try:
+            if isinstance(self.target, str):
+                module_name, _, path = self.target.partition(':')
+                plugin = importlib.import_module(module_name)
+
+                for attr in path.split('.'):
+                    plugin = getattr(plugin, attr)
+            else:
+                plugin = self.target.load()
+        except (ImportError, AttributeError) as ex:
+            raise ImportError(
+                f'Plugin {self.name} cannot be loaded from {self.describe()!r}'
+            ) from ex
+
+        if self.pure:
+            plugin = make_pure(plugin, self.name, self.maxsize)
+
+        return plugin
+
+
+class PluginMap(dict):
+    """
+    The mapping from names to plugins. Lazy plugins are loaded, and replaced
+    by the loaded plugin, the first time they are looked up; checking whether
+    a name is in the mapping never loads anything.
+    """
+
+    def __getitem__(self, name):
+        plugin = super().__getitem__(name)
+
+        if isinstance(plugin, LazyPlugin):
+            plugin = plugin.load()
+            self[name] = plugin
+
+        return plugin
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+
+        return default
+
+
 class PluginStore:
+    """
+    The plugins that parsed content can call, by name.
+
+    Plugins can be registered lazily, with `add_lazy` and a `'module:attr'`
+    string or with `add_entry_points`, in which case they are imported the first time
+    some content calls them, when it is validated.
+    """
 
     def __init__(self):
-        self.plugins = {}
+        self.plugins = PluginMap()
+        self.infos = {}
+
+        # The targets of the plugins that were registered lazily, by name
+        self.targets = {}
+
+        # Incremented whenever a plugin is registered or the store is cleared,
+        # so that results computed with the previous plugins can be discarded
+        self.version = 0
 
-    def add(self, arg, name=None):
+        self._fingerprint = None
+
+    def add(self, arg, name=None, *, pure=False, maxsize=128):
         name = name or arg.__name__
+
+        if pure:
+            arg = make_pure(arg, name, maxsize)
+
         self.plugins[name] = arg
+        self.targets.pop(name, None)
+        self.infos.pop(name, None)
+        self.version += 1
+        self._fingerprint = None
+
+    def add_entry_points(self, group, *, pure=False, maxsize=128):
+        """
+        Registers, lazily, the plugins of an `importlib.metadata` entry point
+        group, using the names of the entry points.
+        """
+
+        for entry_point in entry_points(group):
+            self.add_placeholder(
+                LazyPlugin(entry_point.name, entry_point, pure, maxsize)
+            )
+
+    def add_lazy(self, target, name=None, *, pure=False, maxsize=128):
+        """
+        Registers, lazily, the plugin at a `'module:attr'` target, by default
+        with the name of the attribute.
+        """
 
-    def register(self, fn=None, *, name=None):
+        name = name or target.rpartition(':')[2].rpartition('.')[2]
+        self.add_placeholder(LazyPlugin(name, target, pure, maxsize))
+
+    def add_placeholder(self, plugin):
+        self.plugins[plugin.name] = plugin
+        self.targets[plugin.name] = plugin.describe()
+        self.infos.pop(plugin.name, None)
+        self.version += 1
+        self._fingerprint = None
+
+    def register(self, fn=None, *, name=None, pure=False, maxsize=128):
         def wrapper(fn):
-            self.add(fn, name)
+            self.add(fn, name, pure=pure, maxsize=maxsize)
             return fn
 
         if fn is not None:
@@ -22,6 +254,44 @@ class PluginStore:
 
     def clear(self):
         self.plugins.clear()
+        self.infos.clear()
+        self.targets.clear()
+        self.version += 1
+        self._fingerprint = None
 
     def get(self, name):
         return self.plugins[name]
+
+    def info(self, name):
+        # The metadata is computed the first time it is needed and cached until
+        # the plugin is replaced or the store is cleared
+        try:
+            return self.infos[name]
+        except KeyError:
+            info = self.infos[name] = inspect_plugin(self.plugins[name])
+            return info
+
+    def fingerprint(self):
+        """
+        Returns a digest of the names and metadata of the plugins in this store.
+        Validating and compiling some content depends on the plugins only
+        through this information, so two stores with the same fingerprint
+        produce the same compiled programs.
+
+        Plugins registered lazily are described by their target instead, so
+        that computing the fingerprint does not load them.
+        """
+
+        if self._fingerprint is None:
+            description = repr(sorted(
+                (name, ('lazy', self.targets[name]))
+                if name in self.targets
+                else (name, tuple(self.info(name)))
+                for name in self.plugins
+            ))
+
+            self._fingerprint = hashlib.sha256(
+                description.encode('utf-8')
+            ).hexdigest()
+
+        return self._fingerprint
@@ -1,9 +1,38 @@
-from itertools import chain
+from collections.abc import ItemsView, KeysView, ValuesView
+from itertools import chain, islice
 
 _SENTINEL = object()
 
 
+class SafeKeysView(KeysView):
+    def __iter__(self):
+        return iter(self._mapping)
+
+
+class SafeValuesView(ValuesView):
+    def __iter__(self):
+        return self._mapping.iter_values()
+
+
+class SafeItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
 class SafeEnv:
+    """
+    A view of a dictionary that hides the keys that start and end with double
+    underscores (or, in subclasses, the keys for which `hidden` is true).
+
+    The hidden keys of the inner dictionary are tracked, along with the
+    visible ones in the order of the inner dictionary, so that measuring the
+    environment, testing for keys, iterating and popping items does not need to
+    look at every hidden key. Keys added directly to the inner dictionary are detected the
+    next time the environment is used, as long as its length changed; if the
+    inner dictionary is modified directly in some other way, `refresh` must be
+    called before the environment is used again.
+    """
+
     @classmethod
     def hidden(cls, key):
         return key.startswith('__') and key.endswith('__')
@@ -22,8 +51,55 @@ class SafeEnv:
     def __init__(self, inner):
         self.inner = inner
 
+        # The inner dictionary is only scanned when the environment is first
+        # used, since many environments are never used
+        self.hidden_keys = set()
+        self.visible_keys = {}
+        self.size = None
+
+    def refresh(self):
+        self.hidden_keys = set()
+        self.visible_keys = {}
+        self.track(self.inner)
+        self.size = len(self.inner)
+
+    def track(self, keys):
+        # The visible keys are the keys of a dict, in the order they were added
+        # to the inner dictionary, so that the last one can be popped directly
+        for key in keys:
+            if self.hidden(key):
+                self.hidden_keys.add(key)
+            else:
+                self.visible_keys[key] = None
+
+    def sync(self):
+        size = len(self.inner)
+
+        if size == self.size:
+            return
+
+        if self.size is None or size < self.size:
+            self.refresh()
+            return
+
+        # Keys added to a dictionary are iterated last, so only the new keys
+        # need to be checked
+        new_keys = list(islice(self.reversed_keys(), size - self.size))
+        self.track(reversed(new_keys))
+
+        self.size = size
+
+    def reversed_keys(self):
+        try:
+            return reversed(self.inner)
+        except TypeError:
+            # Not every mapping can be iterated in reverse
+            return reversed(list(self.inner))
+
     def __len__(self):
-        return sum(1 for key in self.inner.keys() if not self.hidden(key))
+        self.sync()
+
+        return len(self.inner) - len(self.hidden_keys)
 
     def __getitem__(self, key):
         if self.hidden(key):
@@ -35,20 +111,54 @@ class SafeEnv:
         if self.hidden(key):
             raise KeyError(f'Unsafe key {key}')
 
-        return self.inner.__setitem__(key, val)
+        self.sync()
+        self.inner.__setitem__(key, val)
+        self.visible_keys[key] = None
+        self.size = len(self.inner)
 
     def __delitem__(self, key):
         if self.hidden(key):
             raise KeyError(f'Unsafe key: {key}')
 
-        return self.inner.__delitem__(key)
-    
+        self.sync()
+        self.inner.__delitem__(key)
+        self.visible_keys.pop(key, None)
+        self.size = len(self.inner)
+
     def __contains__(self, key):
-        return not self.hidden(key) and key in self.inner
-    
+        self.sync()
+
+        return key in self.inner and key not in self.hidden_keys
+
     def __iter__(self):
-        return (key for key in self.inner if not self.hidden(key))
-    
+        self.sync()
+
+        if not self.hidden_keys:
+            return iter(self.inner)
+
+        return iter(self.visible_keys)
+
+    def iter_values(self):
+        self.sync()
+
+        if not self.hidden_keys:
+            return iter(self.inner.values())
+
+        inner = self.inner
+
+        return (inner[key] for key in self.visible_keys)
+
+    def iter_items(self):
+        self.sync()
+
+        if not self.hidden_keys:
+            return iter(self.inner.items())
+
+        inner = self.inner
+
+        return ((key, inner[key]) for key in self.visible_keys)
+
+
     def get(self, key, default=None):
         if self.hidden(key):
             return default
@@ -56,64 +166,81 @@ class SafeEnv:
             return self.inner.get(key, default)
 
     def clear(self):
-        keys = list(self.inner)
-        for key in keys:
-            if not self.hidden(key):
-                del self.inner[key]
-    
-    def items(self):
-        return (
+        self.sync()
+
+        hidden_items = [
             (key, val)
             for key, val in self.inner.items()
-            if not self.hidden(key)
-        )
-    
+            if key in self.hidden_keys
+        ]
+
+        self.inner.clear()
+        self.inner.update(hidden_items)
+        self.visible_keys = {}
+        self.size = len(self.inner)
+
+    def keys(self):
+        return SafeKeysView(self)
+
+    def values(self):
+        return SafeValuesView(self)
+
+    def items(self):
+        return SafeItemsView(self)
+
     def pop(self, key, val=_SENTINEL):
         hidden_key = self.hidden(key)
         val_given = not val is _SENTINEL
 
         if val_given and hidden_key:
             return val
-        elif val_given and not hidden_key:
-            return self.inner.pop(key, val)
         elif not val_given and hidden_key:
             raise KeyError(f'Unsafe key: {key}')
-        elif not val_given and not hidden_key:
-            return self.inner.pop(key)
 
-    def popitem(self):
-        # Pop and collect items from the inner dict until we find one that is
-        # not hidden. When we do so, put back the collected items into the inner
-        # dict in the reverse order. This ensures that the order guarantees of
-        # dicts in python 3.7 are kept.
-        
-        collected = []
-        result = None
-        
-        while self.inner:
-            item = self.inner.popitem()
-            if self.hidden(item[0]):
-                collected.append(item)
-            else:
-                result = item
-                break
-        
-        for key, val in reversed(collected):
-            self.inner[key] = val
-        
-        if result is None:
-            raise KeyError
+        self.sync()
+
+        if val_given:
+            result = self.inner.pop(key, val)
         else:
-            return result
+            result = self.inner.pop(key)
+
+        self.visible_keys.pop(key, None)
+        self.size = len(self.inner)
+
+        return result
+
+    def popitem(self):
+        # The last visible key is removed without looking at the hidden keys
+        # that follow it, which keeps the order of the inner dict
+        self.sync()
+
+        if not self.visible_keys:
+            raise KeyError('popitem(): dictionary is empty')
+
+        key, _ = self.visible_keys.popitem()
+        result = key, self.inner.pop(key)
+        self.size = len(self.inner)
+
+        return result
 
     def setdefault(self, key, default=None):
         if self.hidden(key):
             raise KeyError(f'Unsafe key {key}')
 
-        return self.inner.setdefault(key, default)
+        self.sync()
+        result = self.inner.setdefault(key, default)
+        self.visible_keys[key] = None
+        self.size = len(self.inner)
+
+        return result
 
     def update(self, mapping=(), **kwargs):
-        self.inner.update(self.process_args(mapping, **kwargs))
+        self.sync()
+
+        items = dict(self.process_args(mapping, **kwargs))
+        self.inner.update(items)
+        self.visible_keys.update(dict.fromkeys(items))
+        self.size = len(self.inner)
 
     def repr_item(self, key, value):
         if value is self:
@@ -131,14 +258,3 @@ class SafeEnv:
 
         return f'{name}({inner})'
 
-
-
-# TODO
-# We're missing the `keys` and `values` methods, which should return views into
-# the dictionary without the hidden keys. This will be implemented, if
-# necessary, later.
-
-# TODO
-# As implemented, this class allows subclassing and changing the `hidden` class
-# method, which allows other types of criteria for hiding keys. This is not
-# tested, and should be.
@@ -0,0 +1,164 @@
+import ast
+import marshal
+
+from safeparser.exceptions import ParserException
+
+
+def evaluate_code(code, names):
+    """
+    Evaluates a marshalled expression with the given names. This runs in the
+    executor, possibly in another process, so it only receives the plugins and
+    variables that the expression references.
+    """
+
+    try:
+        return eval(marshal.loads(code), {'__builtins__': {}}, names)
+    except NameError as ex:
+        raise ParserException(ex)
+
+
+class Scheduler:
+    """
+    Executes the statements of a validated module, running the plugin calls of
+    independent statements concurrently on a `concurrent.futures` executor.
+
+    Statements are scheduled in order. Before a statement is submitted, the
+    scheduler waits for the statements that assign the variables it reads (or
+    the variable it assigns), so dependent statements always see their inputs.
+    Statements that call plugins which take the environment may read or modify
+    any variable, so they are barriers: they wait for every statement before
+    them and are executed by the scheduler itself before any statement after
+    them is submitted.
+
+    When statements fail, the scheduler stops submitting statements, waits for
+    the ones that are running, and raises the error of the earliest failing
+    statement. The results of the statements that succeeded are kept.
+    """
+
+    def __init__(self, parser, executor):
+        self.parser = parser
+        self.executor = executor
+
+    def run(self, root):
+        # The futures that have not been collected yet, with the index of their
+        # statement and the variable they assign
+        self.pending = {}
+
+        # The pending future that assigns each variable
+        self.producers = {}
+
+        self.errors = []
+
+        for index, stmt in enumerate(root.body):
+            try:
+                self.schedule(index, stmt)
+            except Exception as ex:
+                self.errors.append((index, ex))
+
+            if self.errors:
+                break
+
+        self.wait(list(self.pending))
+
+        if self.errors:
+            _, ex = min(self.errors, key=lambda error: error[0])
+            raise ex
+
+    def schedule(self, index, stmt):
+        parser = self.parser
+
+        if isinstance(stmt, ast.Assign):
+            identifier = stmt.targets[0].id
+        elif isinstance(stmt, ast.Expr):
+            identifier = None
+        else:
+            self.wait(list(self.pending))
+            parser.reject_stmt(stmt.lineno)
+
+        if parser.processes_statements():
+            # Processing a statement may change what it reads, and expects the
+            # environment to reflect the statements before it
+            self.wait(list(self.pending))
+
+            if self.errors:
+                return
+
+        parser.process_stmt(stmt)
+
+        names = {
+            node.id
+            for node in ast.walk(stmt.value)
+            if isinstance(node, ast.Name)
+        }
+
+        barrier = parser.uses_env(stmt.value)
+
+        if barrier:
+            self.wait(list(self.pending))
+        else:
+            self.wait([
+                self.producers[name]
+                for name in names | {identifier}
+                if name in self.producers
+            ])
+
+        if self.errors:
+            return
+
+        if identifier is not None:
+            parser.ensure_new_variable(identifier, stmt.lineno)
+
+        if isinstance(stmt.value, ast.Call):
+            parser.ensure_plugin(stmt.value.func.id, stmt.lineno)
+
+        if barrier:
+            value = parser.evaluate_expr(stmt.value)
+
+            if identifier is not None:
+                parser.env[identifier] = value
+
+            return
+
+        code = marshal.dumps(parser.compile_expr(stmt.value))
+
+        future = self.executor.submit(
+            evaluate_code, code, self.collect_names(names)
+        )
+
+        self.pending[future] = index, identifier
+
+        if identifier is not None:
+            self.producers[identifier] = future
+
+    def collect_names(self, names):
+        plugin_store = self.parser.plugin_store
+        env = self.parser.env
+
+        result = {}
+
+        for name in names:
+            if plugin_store.has(name):
+                result[name] = plugin_store.get(name)
+            elif name in env:
+                result[name] = env[name]
+
+        return result
+
+    def wait(self, futures):
+        for future in futures:
+            if future not in self.pending:
+                continue
+
+            index, identifier = self.pending.pop(future)
+
+            if self.producers.get(identifier) is future:
+                del self.producers[identifier]
+
+            try:
+                value = future.result()
+            except Exception as ex:
+                self.errors.append((index, ex))
+                continue
+
+            if identifier is not None:
+                self.parser.env[identifier] = value
@@ -0,0 +1,339 @@
+"""
+Plugins that build large sequences lazily: `pairs`, `combinations`,
+`product`, `range` and `repeat`. Their results take a constant amount of
+memory, however long they are, and support `len`, indexing, slicing and
+iteration in chunks, so that the plugins consuming them can process them in
+batches. Register them with `register_plugins`.
+"""
+
+import abc
+import itertools
+import math
+import operator
+from collections.abc import Sequence
+
+
+class LazySequence(Sequence):
+    """
+    A sequence whose elements are computed when they are accessed. Subclasses
+    implement `__len__` and `get`, which receives a non-negative index, and
+    can implement `iter_from` to iterate faster than by computing each element
+    on its own.
+    """
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SliceView(self, range(len(self))[index])
+
+        size = len(self)
+        index = operator.index(index)
+
+        if index < 0:
+            index += size
+
+        if not 0 <= index < size:
+            raise IndexError(f'{type(self).__name__} index out of range')
+
+        return self.get(index)
+
+    @abc.abstractmethod
+    def get(self, index):
+        pass
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        return map(self.get, range(start, len(self)))
+
+    def chunks(self, size):
+        """
+        Iterates over the sequence in lists of `size` elements (the last one
+        may be shorter).
+        """
+        if size < 1:
+            raise ValueError('The size of the chunks must be positive')
+
+        iterator = iter(self)
+
+        while True:
+            chunk = list(itertools.islice(iterator, size))
+
+            if not chunk:
+                return
+
+            yield chunk
+
+    def __repr__(self):
+        return f'<{type(self).__name__} of length {len(self)}>'
+
+
+def as_sequence(items):
+    # Lazy sequences are kept as they are, while other iterables are copied,
+    # so that later changes to them do not change the sequence
+    if isinstance(items, (LazySequence, range, tuple)):
+        return items
+
+    return tuple(items)
+
+
+class SliceView(LazySequence):
+
+    def __init__(self, base, indices):
+        self.base = base
+        self.indices = indices
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SliceView(self.base, self.indices[index])
+
+        return super().__getitem__(index)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def get(self, index):
+        return self.base.get(self.indices[index])
+
+    def iter_from(self, start):
+        indices = self.indices[start:]
+
+        if indices.step == 1:
+            return itertools.islice(
+                self.base.iter_from(indices.start), len(indices)
+            )
+
+        return map(self.base.get, indices)
+
+
+class Range(LazySequence):
+
+    def __init__(self, *args):
+        self.range = range(*args)
+
+    def __len__(self):
+        return len(self.range)
+
+    def get(self, index):
+        return self.range[index]
+
+    def iter_from(self, start):
+        return iter(self.range[start:])
+
+
+class Repeat(LazySequence):
+
+    def __init__(self, value, times):
+        if times < 0:
+            raise ValueError('The number of repetitions cannot be negative')
+
+        self.value = value
+        self.times = times
+
+    def __len__(self):
+        return self.times
+
+    def get(self, index):
+        return self.value
+
+    def iter_from(self, start):
+        return itertools.repeat(self.value, self.times - start)
+
+
+class Combinations(LazySequence):
+    """
+    The `r`-length combinations of the items, in the order of
+    `itertools.combinations`.
+    """
+
+    def __init__(self, items, r):
+        if r < 0:
+            raise ValueError('The length of the combinations cannot be negative')
+
+        self.items = as_sequence(items)
+        self.r = r
+
+    def __len__(self):
+        return math.comb(len(self.items), self.r)
+
+    def get(self, index):
+        return self.select(self.unrank(index))
+
+    def select(self, indices):
+        return tuple(self.items[i] for i in indices)
+
+    def unrank(self, index):
+        n = len(self.items)
+        indices = []
+        i = 0
+
+        for remaining in range(self.r, 0, -1):
+            # Skip the combinations that start with each smaller item
+            while True:
+                count = math.comb(n - i - 1, remaining - 1)
+
+                if index < count:
+                    break
+
+                index -= count
+                i += 1
+
+            indices.append(i)
+            i += 1
+
+        return indices
+
+    def __iter__(self):
+        return itertools.combinations(self.items, self.r)
+
+    def iter_from(self, start):
+        if start == 0:
+            return iter(self)
+
+        return self.iterate(start)
+
+    def iterate(self, start):
+        n, r = len(self.items), self.r
+
+        if start >= len(self):
+            return
+
+        indices = self.unrank(start)
+
+        while True:
+            yield self.select(indices)
+
+            # Advance to the next combination, as `itertools.combinations`
+            for i in reversed(range(r)):
+                if indices[i] != i + n - r:
+                    break
+            else:
+                return
+
+            indices[i] += 1
+
+            for j in range(i + 1, r):
+                indices[j] = indices[j - 1] + 1
+
+
+class Pairs(Combinations):
+    """
+    The pairs of distinct items, in the order of `itertools.combinations`.
+    Indexing takes constant time.
+    """
+
+    def __init__(self, items):
+        super().__init__(items, 2)
+
+    def unrank(self, index):
+        n = len(self.items)
+        b = 2 * n - 1
+
+        # The first item of the pair is the largest `i` whose pairs start at
+        # or before `index`; the square root may be off by one
+        i = (b - math.isqrt(b * b - 8 * index)) // 2
+
+        while i > 0 and self.first_index(i) > index:
+            i -= 1
+
+        while self.first_index(i + 1) <= index:
+            i += 1
+
+        return [i, index - self.first_index(i) + i + 1]
+
+    def first_index(self, i):
+        # The index of the first pair whose first item is the `i`-th one
+        return i * (2 * len(self.items) - i - 1) // 2
+
+    def iterate(self, start):
+        items = self.items
+        n = len(items)
+
+        if start >= len(self):
+            return
+
+        i, j = self.unrank(start)
+
+        while i < n - 1:
+            first = items[i]
+
+            for k in range(j, n):
+                yield first, items[k]
+
+            i += 1
+            j = i + 1
+
+
+class Product(LazySequence):
+    """
+    The cartesian product of the sequences, in the order of
+    `itertools.product`.
+    """
+
+    def __init__(self, *sequences, repeat=1):
+        if repeat < 0:
+            raise ValueError('The number of repetitions cannot be negative')
+
+        self.pools = [as_sequence(items) for items in sequences] * repeat
+
+    def __len__(self):
+        return math.prod(len(pool) for pool in self.pools)
+
+    def get(self, index):
+        return self.select(self.unrank(index))
+
+    def select(self, indices):
+        return tuple(pool[i] for pool, i in zip(self.pools, indices))
+
+    def unrank(self, index):
+        indices = []
+
+        for pool in reversed(self.pools):
+            index, i = divmod(index, len(pool))
+            indices.append(i)
+
+        indices.reverse()
+
+        return indices
+
+    def __iter__(self):
+        return itertools.product(*self.pools)
+
+    def iter_from(self, start):
+        if start == 0:
+            return iter(self)
+
+        return self.iterate(start)
+
+    def iterate(self, start):
+        sizes = [len(pool) for pool in self.pools]
+        indices = self.unrank(start)
+
+        for _ in range(len(self) - start):
+            yield self.select(indices)
+
+            for i in reversed(range(len(indices))):
+                indices[i] += 1
+
+                if indices[i] < sizes[i]:
+                    break
+
+                indices[i] = 0
+
+
+def register_plugins(plugin_store, *, prefix=''):
+    """
+    Registers the sequence plugins into a plugin store, with an optional
+    prefix in their names.
+    """
+
+    plugins = {
+        'pairs': Pairs,
+        'combinations': Combinations,
+        'product': Product,
+        'range': Range,
+        'repeat': Repeat,
+    }
+
+    for name, plugin in plugins.items():
+        plugin_store.add(plugin, prefix + name)
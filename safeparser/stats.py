@@ -0,0 +1,138 @@
+import contextlib
+import threading
+import time
+
+
+class ParseStats:
+    """
+    Collects timing statistics about the parses of the parsers it is attached
+    to, with `Parser(stats=...)`:
+
+    - the total time spent in each phase of parsing: `read`, `parse` (building
+      the AST), `validate`, `process_root`, `compile` and `execute`;
+    - the duration of each executed statement, along with its line number;
+    - for each plugin, the number of calls and the total and maximum time of
+      a call.
+
+    Statistics accumulate over parses until `reset` is called. Subclasses can
+    override the `record_*` methods to forward the measurements elsewhere, such
+    as to a metrics pipeline; they are called with a lock held, so the same
+    statistics can be collected by parses running in several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.phases = {}
+            self.statements = []
+            self.plugins = {}
+            self.local = threading.local()
+
+    @property
+    def current(self):
+        # The line number and starting time of the statement being executed
+        # in this thread
+        return getattr(self.local, 'current', None)
+
+    @current.setter
+    def current(self, current):
+        self.local.current = current
+
+    def __getstate__(self):
+        with self.lock:
+            return {
+                'phases': self.phases,
+                'statements': self.statements,
+                'plugins': self.plugins,
+            }
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+
+            with self.lock:
+                self.record_phase(name, duration)
+
+    def start_statement(self, lineno):
+        now = time.perf_counter()
+
+        self.end_statement(now)
+        self.current = lineno, now
+
+    def end_statement(self, now=None):
+        if self.current is None:
+            return
+
+        if now is None:
+            now = time.perf_counter()
+
+        lineno, start = self.current
+        self.current = None
+
+        with self.lock:
+            self.record_statement(lineno, now - start)
+
+    def timed(self, call_plugin):
+        """
+        Wraps the function that parsers use to call plugins (see
+        `PluginCallWrapper`) so that each call is measured.
+        """
+
+        def timed_call(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return call_plugin(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+
+                with self.lock:
+                    self.record_plugin(args[0], duration)
+
+        return timed_call
+
+    def record_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0) + duration
+
+    def record_statement(self, lineno, duration):
+        self.statements.append((lineno, duration))
+
+    def record_plugin(self, identifier, duration):
+        stats = self.plugins.get(identifier)
+
+        if stats is None:
+            stats = self.plugins[identifier] = {
+                'calls': 0,
+                'total': 0,
+                'max': 0,
+            }
+
+        stats['calls'] += 1
+        stats['total'] += duration
+        stats['max'] = max(stats['max'], duration)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'phases': dict(self.phases),
+                'statements': [
+                    {'lineno': lineno, 'duration': duration}
+                    for lineno, duration in self.statements
+                ],
+                'plugins': {
+                    identifier: dict(stats)
+                    for identifier, stats in self.plugins.items()
+                },
+            }
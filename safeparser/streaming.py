@@ -0,0 +1,57 @@
+import codecs
+import tokenize
+
+
+def iter_statements(readline):
+    """
+    Reads python source code incrementally with `readline` and yields a
+    `(lineno, source)` pair for each top-level logical line, as soon as it is
+    complete. `lineno` is the number of the first line of `source` in the
+    original input. Comments and blank lines are attached to the statement that
+    follows them. If `readline` returns bytes, they are decoded as python does
+    with source files, following their encoding declaration.
+
+    Raises `tokenize.TokenError` if the input ends in the middle of a
+    statement, and `SyntaxError` or `UnicodeDecodeError` if bytes cannot be
+    decoded.
+    """
+
+    # The lines that have been read but not yet yielded, starting at `lineno`
+    lines = []
+    lineno = 1
+
+    # The first line tells whether the input is binary, and is then read again
+    first = [readline()]
+
+    def recording_readline():
+        line = first.pop() if first else readline()
+        lines.append(line)
+        return line
+
+    if isinstance(first[0], bytes):
+        # The byte order mark is not part of the first statement
+        if first[0].startswith(codecs.BOM_UTF8):
+            first[0] = first[0][len(codecs.BOM_UTF8):]
+
+        tokens = tokenize.tokenize(recording_readline)
+    else:
+        tokens = tokenize.generate_tokens(recording_readline)
+
+    encoding = None
+
+    for token in tokens:
+        if token.type == tokenize.ENCODING:
+            encoding = token.string
+
+        if token.type != tokenize.NEWLINE:
+            continue
+
+        end = token.end[0] - lineno + 1
+
+        if encoding is None:
+            yield lineno, ''.join(lines[:end])
+        else:
+            yield lineno, b''.join(lines[:end]).decode(encoding)
+
+        del lines[:end]
+        lineno += end
@@ -0,0 +1,43 @@
+import pytest
+
+from safeparser.budget import Budget, value_size
+from safeparser.exceptions import BudgetExceeded
+from safeparser.sequences import Pairs, Range
+
+
+def test_value_size_counts_containers_and_their_elements():
+    assert value_size(0, 100) == 1
+    assert value_size('abc', 100) == 3
+    assert value_size([], 100) == 0
+    assert value_size([0, 'ab'], 100) == 5
+    assert value_size({'a': (0, 1)}, 100) == 6
+    assert value_size({0, 1}, 100) == 4
+    assert value_size(Pairs('abc'), 100) == 15
+
+
+def test_value_size_stops_once_the_limit_is_exceeded():
+    assert value_size([0] * 1000, 10) == 1000
+
+    cycle = []
+    cycle.append(cycle)
+
+    assert value_size(cycle, 10) == 11
+
+    assert value_size(Pairs(Range(10 ** 9)), 10) > 10
+
+
+def test_budgets_check_the_size_of_the_source():
+    budget = Budget(max_source_bytes=4)
+
+    budget.check_source('a')
+    budget.check_source('abcd')
+
+    with pytest.raises(BudgetExceeded):
+        budget.check_source('abcde')
+
+    with pytest.raises(BudgetExceeded):
+        budget.check_source('ãã€')
+
+
+def test_budgets_without_a_source_limit_accept_anything():
+    Budget().check_source('a' * 10000)
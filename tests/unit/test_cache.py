@@ -0,0 +1,170 @@
+import os
+import pickle
+
+from safeparser.cache import DiskProgramCache, Program, ProgramCache
+
+
+def test_cache_returns_none_for_unknown_keys():
+    cache = ProgramCache()
+
+    assert cache.get('key') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_cache_returns_stored_programs():
+    cache = ProgramCache()
+    program = object()
+
+    cache.put('key', program)
+
+    assert cache.get('key') is program
+    assert cache.stats()['hits'] == 1
+
+
+def test_cache_evicts_the_least_recently_used_program():
+    cache = ProgramCache(maxsize=2)
+
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {
+        'hits': 3,
+        'misses': 1,
+        'evictions': 1,
+        'size': 2,
+        'maxsize': 2,
+    }
+
+
+def test_cache_can_be_cleared():
+    cache = ProgramCache()
+
+    cache.put('a', 1)
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.get('a') is None
+
+
+def make_program(source='a = 1'):
+    return Program(compile(source, '<string>', 'exec'), frozenset('a'))
+
+
+def run(program):
+    namespace = {}
+    exec(program.code, {}, namespace)
+
+    return namespace
+
+
+def test_disk_caches_persist_programs(tmp_path):
+    DiskProgramCache(tmp_path).put(('key', 1), make_program())
+
+    cache = DiskProgramCache(tmp_path)
+    program = cache.get(('key', 1))
+
+    assert run(program) == {'a': 1}
+    assert program.assigned == {'a'}
+    assert cache.get(('key', 2)) is None
+    assert cache.stats()['disk_hits'] == 1
+    assert cache.stats()['disk_misses'] == 1
+
+    # The program is now in memory
+    assert cache.get(('key', 1)) is program
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_disk_caches_use_stable_names_for_classes(tmp_path):
+    DiskProgramCache(tmp_path).put(('key', ProgramCache), make_program())
+
+    cache = DiskProgramCache(tmp_path)
+
+    assert cache.header(('key', ProgramCache)) == cache.header(
+        ('key', DiskProgramCache.__mro__[1])
+    )
+    assert cache.get(('key', ProgramCache)) is not None
+    assert cache.get(('key', DiskProgramCache)) is None
+
+
+def test_disk_caches_detect_corrupt_entries(tmp_path):
+    cache = DiskProgramCache(tmp_path)
+    cache.put('key', make_program())
+
+    path = cache.path(cache.header('key'))
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for corrupt in [b'', data[:-1], data[:-1] + b'\0', b'x' + data[1:]]:
+        with open(path, 'wb') as f:
+            f.write(corrupt)
+
+        cache = DiskProgramCache(tmp_path)
+
+        assert cache.get('key') is None
+        assert cache.stats()['disk_errors'] == 1
+
+    # A corrupt entry is replaced when the program is stored again
+    cache.put('key', make_program('a = 2'))
+
+    assert run(DiskProgramCache(tmp_path).get('key')) == {'a': 2}
+
+
+def test_disk_caches_detect_entries_of_other_keys(tmp_path):
+    cache = DiskProgramCache(tmp_path)
+    cache.put('key', make_program())
+
+    os.replace(
+        cache.path(cache.header('key')),
+        cache.path(cache.header('other')),
+    )
+
+    assert DiskProgramCache(tmp_path).get('other') is None
+
+
+def test_disk_caches_survive_unwritable_directories(tmp_path):
+    directory = tmp_path / 'file'
+    directory.write_text('')
+
+    cache = DiskProgramCache(directory)
+    cache.put('key', make_program())
+
+    assert cache.get('key') is not None
+    assert DiskProgramCache(directory).get('key') is None
+    assert cache.stats()['disk_errors'] == 1
+
+
+def test_disk_caches_can_be_cleared(tmp_path):
+    cache = DiskProgramCache(tmp_path)
+    cache.put('key', make_program())
+    cache.clear()
+
+    assert cache.get('key') is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_disk_caches_only_clear_their_own_files(tmp_path):
+    (tmp_path / 'firmware.bin').write_bytes(b'')
+    (tmp_path / 'notes.tmp').write_bytes(b'')
+    (tmp_path / 'program-abc123.tmp').write_bytes(b'')
+
+    cache = DiskProgramCache(tmp_path)
+    cache.put('key', make_program())
+    cache.clear()
+
+    assert sorted(os.listdir(tmp_path)) == ['firmware.bin', 'notes.tmp']
+
+
+def test_disk_caches_keep_their_directory_when_pickled(tmp_path):
+    cache = DiskProgramCache(tmp_path, maxsize=4)
+    cache.put('key', make_program())
+
+    copy = pickle.loads(pickle.dumps(cache))
+
+    assert copy.maxsize == 4
+    assert run(copy.get('key')) == {'a': 1}
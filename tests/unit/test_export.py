@@ -0,0 +1,161 @@
+import io
+import json
+import tempfile
+
+import pytest
+
+from safeparser.export import export_jsonl
+from safeparser.overlay import OverlayEnv
+from safeparser.sequences import Pairs, Range
+
+
+def export(env, **kwargs):
+    f = io.StringIO()
+    export_jsonl(env, f, **kwargs)
+
+    return [json.loads(line) for line in f.getvalue().splitlines()]
+
+
+def test_exports_one_line_per_variable():
+    assert export({'a': 1, 'b': 'x', 'c': None}) == [
+        {'name': 'a', 'value': 1},
+        {'name': 'b', 'value': 'x'},
+        {'name': 'c', 'value': None},
+    ]
+
+    assert export({}) == []
+
+
+def test_exports_the_values_the_parser_produces():
+    env = {
+        'a': (1, [2.5, True]),
+        'b': {3},
+        'c': 1 + 2j,
+        'd': {'k': {1: 'x', None: 'y', (1, 2): 'z'}},
+    }
+
+    assert [line['value'] for line in export(env)] == [
+        [1, [2.5, True]],
+        [3],
+        {'real': 1.0, 'imag': 2.0},
+        {'k': {'1': 'x', 'null': 'y', '[1,2]': 'z'}},
+    ]
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 1024])
+def test_exports_large_values_in_batches(batch_size):
+    env = {
+        'a': [(i, {i}) for i in range(100)],
+        'b': {i: [i] * 5 for i in range(50)},
+        'c': [list(range(10)), [], {}, {(0, 1): [1, 2, 3]}],
+        'd': [],
+        'e': {},
+    }
+
+    assert export(env, batch_size=batch_size) == [
+        {'name': 'a', 'value': [[i, [i]] for i in range(100)]},
+        {'name': 'b', 'value': {str(i): [i] * 5 for i in range(50)}},
+        {'name': 'c', 'value': [list(range(10)), [], {}, {'[0,1]': [1, 2, 3]}]},
+        {'name': 'd', 'value': []},
+        {'name': 'e', 'value': {}},
+    ]
+
+
+def test_exports_in_chunks():
+    class Recorder(io.StringIO):
+        def __init__(self):
+            super().__init__()
+            self.chunks = []
+
+        def write(self, chunk):
+            self.chunks.append(chunk)
+            return super().write(chunk)
+
+    f = Recorder()
+    env = {f'a{i}': list(range(100)) for i in range(100)}
+
+    export_jsonl(env, f, chunk_size=1000)
+
+    assert len(f.chunks) > 10
+    assert all(len(chunk) < 2000 for chunk in f.chunks)
+    assert len(f.getvalue().splitlines()) == 100
+
+
+def test_exports_large_containers_nested_in_small_ones():
+    class Recorder(io.StringIO):
+        def __init__(self):
+            super().__init__()
+            self.chunks = []
+
+        def write(self, chunk):
+            self.chunks.append(chunk)
+            return super().write(chunk)
+
+    f = Recorder()
+    env = {
+        'x': {'big': [list(range(1000))], 'small': [1]},
+        'y': [[[i] * 10 for i in range(100)]],
+    }
+
+    export_jsonl(env, f, chunk_size=100, batch_size=50)
+
+    assert max(len(chunk) for chunk in f.chunks) < 500
+    assert [json.loads(line) for line in f.getvalue().splitlines()] == [
+        {'name': 'x', 'value': {'big': [list(range(1000))], 'small': [1]}},
+        {'name': 'y', 'value': [[[i] * 10 for i in range(100)]]},
+    ]
+
+
+def test_exports_lazy_sequences():
+    env = {
+        'a': Pairs('abc'),
+        'b': Pairs(Range(100)),
+        'c': [Range(3), {'d': Range(1000)}],
+    }
+
+    assert export(env, batch_size=50) == [
+        {'name': 'a', 'value': [['a', 'b'], ['a', 'c'], ['b', 'c']]},
+        {
+            'name': 'b',
+            'value': [[i, j] for i in range(100) for j in range(i + 1, 100)],
+        },
+        {'name': 'c', 'value': [[0, 1, 2], {'d': list(range(1000))}]},
+    ]
+
+
+def test_exports_to_binary_files():
+    f = io.BytesIO()
+    export_jsonl({'a': 'ação'}, f)
+
+    assert json.loads(f.getvalue()) == {'name': 'a', 'value': 'ação'}
+
+
+@pytest.mark.parametrize('mode', ['w+', 'wb+'])
+def test_exports_to_files_that_only_tell_their_mode(mode):
+    with tempfile.NamedTemporaryFile(mode) as f:
+        export_jsonl({'a': 1}, f)
+        f.seek(0)
+
+        assert json.loads(f.read()) == {'name': 'a', 'value': 1}
+
+
+def test_exports_other_values_with_a_default():
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    env = {'p': [Point(1, 2)]}
+
+    with pytest.raises(TypeError):
+        export(env)
+
+    assert export(env, default=lambda p: [p.x, p.y]) == [
+        {'name': 'p', 'value': [[1, 2]]},
+    ]
+
+
+def test_exports_any_environment():
+    env = OverlayEnv({'a': 1})
+    env['b'] = 2
+
+    assert export(env) == [{'name': 'a', 'value': 1}, {'name': 'b', 'value': 2}]
@@ -0,0 +1,127 @@
+import pytest
+
+from safeparser.incremental import IncrementalParser
+from safeparser.parser import Parser, ParserException
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def parser(calls):
+    parser = Parser(env={'base': 0})
+
+    @parser.plugin_store.register
+    def f(x):
+        calls.append(x)
+        return [x]
+
+    @parser.plugin_store.register
+    def names(*, env):
+        calls.append('names')
+        return sorted(env)
+
+    return parser
+
+
+def test_unchanged_statements_are_reused(parser, calls):
+    incremental = IncrementalParser(parser)
+
+    env = incremental.parse('a = f(1)\nb = f(a)\nc = f(2)')
+
+    assert dict(env) == {'base': 0, 'a': [1], 'b': [[1]], 'c': [2]}
+    assert incremental.executed == [1, 2, 3]
+
+    calls.clear()
+    env = incremental.parse('a = f(1)\nb = f(a)\nc = f(3)')
+
+    assert dict(env) == {'base': 0, 'a': [1], 'b': [[1]], 'c': [3]}
+    assert calls == [3]
+    assert incremental.reused == [1, 2]
+    assert parser.env == {'base': 0}
+
+
+def test_dependents_of_changed_statements_are_executed(parser, calls):
+    incremental = IncrementalParser(parser)
+    incremental.parse('a = f(1)\nb = f(a)\nc = [b]\nd = f(2)')
+
+    calls.clear()
+    env = incremental.parse('a = f(5)\nb = f(a)\nc = [b]\nd = f(2)')
+
+    assert env['c'] == [[[5]]]
+    assert calls == [5, [5]]
+    assert incremental.executed == [1, 2, 3]
+    assert incremental.reused == [4]
+
+
+def test_moved_and_reformatted_statements_are_reused(parser, calls):
+    incremental = IncrementalParser(parser)
+    incremental.parse('a = f(1)\nb = f(2)')
+
+    calls.clear()
+    env = incremental.parse('b = f( 2 )\n\n# Comment\na = f(1)')
+
+    assert dict(env) == {'base': 0, 'a': [1], 'b': [2]}
+    assert calls == []
+
+    env = incremental.parse('a = f(1); b = f(3)')
+
+    assert dict(env) == {'base': 0, 'a': [1], 'b': [3]}
+    assert calls == [3]
+
+
+def test_statements_using_the_env_invalidate_what_follows(parser, calls):
+    incremental = IncrementalParser(parser)
+    incremental.parse('a = f(1)\nn = names()\nb = f(2)')
+
+    calls.clear()
+    env = incremental.parse('a = f(1)\nn = names()\nb = f(2)')
+
+    assert env['n'] == ['a', 'base']
+    assert calls == ['names', 2]
+    assert incremental.reused == [1]
+
+
+def test_edits_report_the_errors_of_reused_statements(parser, calls):
+    incremental = IncrementalParser(parser)
+    incremental.parse('a = f(1)\nb = [a]')
+
+    # The statement assigning `b` is unchanged, but `a` no longer exists
+    with pytest.raises(ParserException):
+        incremental.parse('b = [a]')
+
+    with pytest.raises(ParserException, match='l.2'):
+        incremental.parse('a = f(1)\na = f(1)')
+
+    # Failed versions do not replace the results of the last valid one
+    calls.clear()
+    env = incremental.parse('a = f(1)\nb = [a]')
+
+    assert dict(env) == {'base': 0, 'a': [1], 'b': [[1]]}
+    assert calls == []
+
+
+def test_changing_the_plugins_executes_everything_again(parser, calls):
+    incremental = IncrementalParser(parser)
+    incremental.parse('a = f(1)')
+
+    parser.plugin_store.add(len)
+
+    calls.clear()
+    incremental.parse('a = f(1)')
+
+    assert calls == [1]
+
+
+def test_replacing_a_plugin_executes_everything_again(parser):
+    parser.plugin_store.add(lambda x: x, 'score')
+
+    incremental = IncrementalParser(parser)
+    incremental.parse('a = score(2)')
+
+    parser.plugin_store.add(lambda x: 10 * x, 'score')
+
+    assert dict(incremental.parse('a = score(2)')) == {'base': 0, 'a': 20}
+    assert incremental.reused == []
@@ -0,0 +1,95 @@
+import pytest
+
+from safeparser.overlay import OverlayEnv
+
+
+def test_overlays_read_from_the_base():
+    env = OverlayEnv({'a': 0, 'b': 1})
+
+    assert env['a'] == 0
+    assert 'b' in env
+    assert 'c' not in env
+    assert len(env) == 2
+    assert list(env) == ['a', 'b']
+
+    with pytest.raises(KeyError):
+        env['c']
+
+
+def test_overlays_do_not_modify_the_base():
+    base = {'a': 0, 'b': 1}
+    env = OverlayEnv(base)
+
+    env['a'] = 10
+    env['c'] = 2
+    del env['b']
+
+    assert base == {'a': 0, 'b': 1}
+    assert dict(env) == {'a': 10, 'c': 2}
+    assert len(env) == 2
+    assert 'b' not in env
+
+    with pytest.raises(KeyError):
+        env['b']
+
+    with pytest.raises(KeyError):
+        del env['b']
+
+
+def test_overlays_keep_the_order_of_variables():
+    env = OverlayEnv({'a': 0, 'b': 1, 'c': 2})
+
+    env['d'] = 3
+    env['a'] = 4
+    del env['b']
+    env['e'] = 5
+    env['b'] = 6
+
+    assert list(env) == ['a', 'b', 'c', 'd', 'e']
+    assert list(reversed(env)) == ['e', 'd', 'c', 'b', 'a']
+    assert len(env) == 5
+
+
+def test_overlays_track_added_variables():
+    env = OverlayEnv({'a': 0})
+
+    env['b'] = 1
+    env['b'] = 2
+    del env['b']
+
+    assert len(env) == 1
+    assert list(env) == ['a']
+
+    del env['a']
+    env['a'] = 1
+
+    assert len(env) == 1
+    assert env.changes == {'a': 1}
+
+
+def test_overlays_can_be_cleared():
+    base = {'a': 0, 'b': 1}
+    env = OverlayEnv(base)
+
+    env['c'] = 2
+    env.clear()
+
+    assert len(env) == 0
+    assert list(env) == []
+    assert base == {'a': 0, 'b': 1}
+
+    env['a'] = 3
+
+    assert dict(env) == {'a': 3}
+
+
+def test_overlays_can_be_stacked():
+    base = {'a': 0}
+    first = OverlayEnv(base)
+    first['b'] = 1
+    second = OverlayEnv(first)
+    second['c'] = 2
+    del second['a']
+
+    assert dict(first) == {'a': 0, 'b': 1}
+    assert dict(second) == {'b': 1, 'c': 2}
@@ -1,3 +1,6 @@
+import functools
+import sys
+
 import pytest
 
 from safeparser.plugins import PluginStore
@@ -58,6 +61,14 @@ def test_plugins_can_be_values(plugin_store):
     assert plugin_store.get('random_number') == random_number
 
 
+def test_strings_are_values_rather_than_lazy_targets(plugin_store):
+    plugin_store.add('hello world', 'greeting')
+    plugin_store.add('os:getcwd', 'target')
+
+    assert plugin_store.get('greeting') == 'hello world'
+    assert plugin_store.get('target') == 'os:getcwd'
+
+
 def test_plugins_can_be_classes(plugin_store):
     @plugin_store.register
     class MyClass:
@@ -65,3 +76,237 @@ def test_plugins_can_be_classes(plugin_store):
             self.arg = arg
 
     assert plugin_store.get('MyClass') is MyClass
+
+
+def test_plugin_store_describes_plugins(plugin_store):
+    @plugin_store.register
+    def fn(a, b=0, *, env):
+        pass
+
+    @plugin_store.register
+    def variadic(a, *args):
+        pass
+
+    plugin_store.add(4, 'value')
+
+    assert plugin_store.info('fn') == (True, True)
+    assert plugin_store.info('variadic') == (True, False)
+    assert plugin_store.info('value') == (False, False)
+
+
+def test_plugin_info_describes_wrappers_rather_than_wrapped_plugins(
+    plugin_store
+):
+    def fn(a, *, env):
+        pass
+
+    @plugin_store.register
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return fn(*args, env={}, **kwargs)
+
+    assert plugin_store.info('fn').wants_env is False
+
+
+def test_plugin_info_is_computed_once(plugin_store, monkeypatch):
+    import safeparser.plugins
+
+    calls = []
+
+    def counting_inspect_plugin(plugin):
+        calls.append(plugin)
+        return safeparser.plugins.PluginInfo(True, False)
+
+    monkeypatch.setattr(
+        safeparser.plugins, 'inspect_plugin', counting_inspect_plugin
+    )
+
+    plugin_store.add(len)
+    plugin_store.info('len')
+    plugin_store.info('len')
+
+    assert calls == [len]
+
+
+def test_plugin_info_is_invalidated_when_plugins_change(plugin_store):
+    @plugin_store.register(name='fn')
+    def fn1(x): pass
+
+    assert plugin_store.info('fn').wants_env is False
+
+    @plugin_store.register(name='fn')
+    def fn2(x, *, env): pass
+
+    assert plugin_store.info('fn').wants_env is True
+
+    plugin_store.clear()
+    plugin_store.add(4, 'fn')
+
+    assert plugin_store.info('fn').callable is False
+
+
+def test_pure_plugins_are_memoized(plugin_store):
+    calls = []
+
+    @plugin_store.register(pure=True)
+    def pairs(items):
+        calls.append(items)
+        return [(a, b) for a in items for b in items if a < b]
+
+    plugin = plugin_store.get('pairs')
+
+    assert plugin([1, 2, 3]) == [(1, 2), (1, 3), (2, 3)]
+    assert plugin([1, 2, 3]) == [(1, 2), (1, 3), (2, 3)]
+    assert plugin((1, 2, 3)) == [(1, 2), (1, 3), (2, 3)]
+    assert calls == [[1, 2, 3], (1, 2, 3)]
+    assert plugin.stats()['hits'] == 1
+    assert plugin.stats()['misses'] == 2
+
+
+def test_pure_plugins_canonicalize_their_arguments(plugin_store):
+    calls = []
+
+    @plugin_store.register(pure=True)
+    def fn(*args, **kwargs):
+        calls.append((args, kwargs))
+
+    plugin = plugin_store.get('fn')
+
+    plugin({'a': [1, {2}]}, key={3: (4,)})
+    plugin({'a': [1, {2}]}, key={3: (4,)})
+    plugin(1)
+    plugin(True)
+    plugin(1.0)
+
+    assert len(calls) == 4
+
+
+def test_pure_plugins_call_through_for_unhashable_arguments(plugin_store):
+    calls = []
+
+    @plugin_store.register(pure=True)
+    def fn(x):
+        calls.append(x)
+
+    plugin = plugin_store.get('fn')
+    arg = object.__new__(type('Unhashable', (), {'__hash__': None}))
+
+    plugin(arg)
+    plugin(arg)
+
+    assert len(calls) == 2
+
+
+def test_pure_plugin_caches_can_be_cleared_and_resized(plugin_store):
+    @plugin_store.register(pure=True, maxsize=2)
+    def fn(x):
+        return x
+
+    plugin = plugin_store.get('fn')
+
+    plugin(1)
+    plugin(2)
+    plugin(3)
+
+    assert plugin.stats()['size'] == 2
+    assert plugin.stats()['evictions'] == 1
+
+    plugin.resize(1)
+
+    assert plugin.stats()['size'] == 1
+
+    plugin.clear()
+
+    assert plugin.stats()['size'] == 0
+
+
+def test_plugins_that_take_the_env_cannot_be_pure(plugin_store):
+    with pytest.raises(ValueError):
+        @plugin_store.register(pure=True)
+        def fn(*, env):
+            pass
+
+    assert not plugin_store.has('fn')
+
+
+def test_pure_plugins_keep_their_metadata(plugin_store):
+    @plugin_store.register(pure=True)
+    def fn(a, b=0):
+        pass
+
+    assert plugin_store.info('fn') == (True, False)
+
+
+@pytest.fixture
+def plugin_module(tmp_path, monkeypatch):
+    # A module that is only imported when one of its plugins is loaded
+    (tmp_path / 'lazy_plugins.py').write_text(
+        'def double(x):\n'
+        '    return 2 * x\n'
+        '\n'
+        'def count(*, env):\n'
+        '    return len(env)\n'
+    )
+
+    monkeypatch.syspath_prepend(tmp_path)
+    monkeypatch.delitem(sys.modules, 'lazy_plugins', raising=False)
+
+    return tmp_path
+
+
+def test_lazy_plugins_are_loaded_when_used(plugin_store, plugin_module):
+    plugin_store.add_lazy('lazy_plugins:double')
+    plugin_store.add_lazy('lazy_plugins:count', 'size')
+    fingerprint = plugin_store.fingerprint()
+
+    assert plugin_store.has('double')
+    assert plugin_store.has('size')
+    assert 'lazy_plugins' not in sys.modules
+
+    assert plugin_store.get('double')(2) == 4
+    assert plugin_store.info('size').wants_env
+    assert 'lazy_plugins' in sys.modules
+
+    # The fingerprint does not depend on whether the plugins were loaded
+    assert plugin_store.fingerprint() == fingerprint
+
+
+def test_lazy_plugins_can_be_pure(plugin_store, plugin_module):
+    plugin_store.add_lazy('lazy_plugins:double', pure=True)
+    plugin_store.add_lazy('lazy_plugins:count', pure=True)
+
+    assert plugin_store.get('double')(2) == 4
+    assert plugin_store.get('double').stats()['misses'] == 1
+
+    with pytest.raises(ValueError):
+        plugin_store.get('count')
+
+
+def test_lazy_plugins_report_missing_targets(plugin_store, plugin_module):
+    plugin_store.add_lazy('lazy_plugins:missing')
+    plugin_store.add_lazy('missing_module:fn')
+
+    with pytest.raises(ImportError, match='lazy_plugins:missing'):
+        plugin_store.get('missing')
+
+    with pytest.raises(ImportError, match='missing_module:fn'):
+        plugin_store.get('fn')
+
+
+def test_lazy_plugins_can_come_from_entry_points(plugin_store, plugin_module):
+    dist_info = plugin_module / 'lazy_plugins-1.0.dist-info'
+    dist_info.mkdir()
+    (dist_info / 'METADATA').write_text(
+        'Metadata-Version: 2.1\nName: lazy-plugins\nVersion: 1.0\n'
+    )
+    (dist_info / 'entry_points.txt').write_text(
+        '[safeparser.test_plugins]\n'
+        'twice = lazy_plugins:double\n'
+    )
+
+    plugin_store.add_entry_points('safeparser.test_plugins')
+
+    assert plugin_store.has('twice')
+    assert 'lazy_plugins' not in sys.modules
+
+    assert plugin_store.get('twice')(3) == 6
@@ -260,3 +260,136 @@ def test_safe_env_can_be_represented():
     env['self'] = env
 
     assert repr(env) == 'SafeEnv({\'a\': 0, \'self\': SafeEnv({...})})'
+
+
+def test_safe_env_has_live_views():
+    inner = {'a': 0, '__hidden__': 1}
+    env = SafeEnv(inner)
+
+    keys = env.keys()
+    values = env.values()
+    items = env.items()
+
+    assert list(keys) == ['a']
+    assert list(values) == [0]
+    assert list(items) == [('a', 0)]
+
+    env['b'] = 2
+
+    assert len(keys) == 2
+    assert 'b' in keys
+    assert '__hidden__' not in keys
+    assert 2 in values
+    assert 1 not in values
+    assert ('b', 2) in items
+    assert ('__hidden__', 1) not in items
+
+
+def test_safe_env_views_support_set_operations():
+    env = SafeEnv({'a': 0, 'b': 1, '__hidden__': 2})
+
+    assert env.keys() & {'a', '__hidden__'} == {'a'}
+    assert env.keys() | {'c'} == {'a', 'b', 'c'}
+    assert env.keys() - {'a'} == {'b'}
+    assert env.keys() == {'a', 'b'}
+    assert env.items() & {('b', 1)} == {('b', 1)}
+
+
+def test_safe_env_tracks_keys_added_to_the_inner_dict():
+    inner = {'a': 0}
+    env = SafeEnv(inner)
+
+    inner['__hidden__'] = 0
+    inner['b'] = 1
+
+    assert len(env) == 2
+    assert list(env) == ['a', 'b']
+    assert '__hidden__' not in env
+
+    del inner['__hidden__']
+
+    assert len(env) == 2
+    assert env.popitem() == ('b', 1)
+    assert env.popitem() == ('a', 0)
+
+    with pytest.raises(KeyError):
+        env.popitem()
+
+
+def test_safe_env_refreshes_after_the_inner_dict_is_replaced():
+    inner = {'a': 0}
+    env = SafeEnv(inner)
+
+    del inner['a']
+    inner['__hidden__'] = 0
+
+    env.refresh()
+
+    assert len(env) == 0
+    assert list(env) == []
+
+
+def test_safe_env_popitem_skips_trailing_hidden_keys():
+    inner = {'a': 0, 'b': 1, '__x__': 2, '__y__': 3}
+    env = SafeEnv(inner)
+
+    assert env.popitem() == ('b', 1)
+    assert list(inner) == ['a', '__x__', '__y__']
+    assert len(env) == 1
+
+
+def test_safe_env_keeps_visible_keys_in_the_order_of_the_inner_dict():
+    inner = {'a': 0, '__x__': 1}
+    env = SafeEnv(inner)
+
+    env['b'] = 2
+    inner['__y__'] = 3
+    inner['c'] = 4
+    env.update({'a': 5, 'd': 6}, e=7)
+    env.setdefault('f', 8)
+    del env['b']
+    env.pop('d')
+
+    assert list(env) == ['a', 'c', 'e', 'f']
+    assert list(env.values()) == [5, 4, 7, 8]
+    assert [env.popitem() for _ in range(4)] == [
+        ('f', 8), ('e', 7), ('c', 4), ('a', 5)
+    ]
+    assert list(inner) == ['__x__', '__y__']
+
+    with pytest.raises(KeyError):
+        env.popitem()
+
+
+def test_safe_env_clear_keeps_hidden_keys_in_order():
+    inner = {'__x__': 0, 'a': 1, '__y__': 2}
+    env = SafeEnv(inner)
+
+    env.clear()
+
+    assert list(inner) == ['__x__', '__y__']
+    assert len(env) == 0
+
+
+def test_safe_env_hidden_keys_can_be_customized():
+    class PrivateEnv(SafeEnv):
+        @classmethod
+        def hidden(cls, key):
+            return key.startswith('_')
+
+    inner = {'a': 0, '_private': 1}
+    env = PrivateEnv(inner)
+
+    assert len(env) == 1
+    assert list(env.keys()) == ['a']
+    assert '_private' not in env
+
+    with pytest.raises(KeyError):
+        env['_other'] = 2
+
+    env.update({'_other': 2, 'b': 3})
+
+    inner['_added'] = 4
+
+    assert list(env.items()) == [('a', 0), ('b', 3)]
+    assert env.popitem() == ('b', 3)
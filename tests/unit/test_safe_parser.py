@@ -1,10 +1,30 @@
+import ast
+import asyncio
+import functools
+import io
 import os
+import sys
 import textwrap
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import pytest
 
-from safeparser.parser import Parser, ParserException
+from safeparser.budget import Budget
+from safeparser.cache import DiskProgramCache, ProgramCache
+from safeparser.exceptions import BudgetExceeded
+from safeparser.hooks import NodeHook
+from safeparser.parser import (
+    EnvironmentInjector,
+    Parser,
+    ParserException,
+    SafeCodeValidator,
+)
 from safeparser.plugins import PluginStore
+from safeparser.safe_env import SafeEnv
+from safeparser.stats import ParseStats
 
 
 @pytest.fixture
@@ -158,6 +178,21 @@ def test_parsers_reject_double_underscore_variable_names(parser):
     assert parser.env == {'__abc': 0, 'abc__': 0}
 
 
+@pytest.mark.parametrize('content', [
+    'a = [__new_variable__]',
+    'a = [__new_variable__("q", 1)]',
+    'a = {"k": __illegal__}',
+    'a = [__builtins__]',
+])
+def test_parsers_reject_reading_internal_names(content):
+    parser = Parser(budget=Budget(timeout=10), stats=ParseStats())
+
+    with pytest.raises(ParserException):
+        parser.parse(content)
+
+    assert parser.env == {}
+
+
 def test_parsers_can_use_previously_defined_variables(parser):
     parser.parse(textwrap.dedent('''
         a = 0
@@ -253,3 +288,1395 @@ def test_parser_plugins_cannot_access_or_create_double_underscore_variables(pars
 
     with pytest.raises(KeyError):
         parser.parse('fn2()')
+
+
+def test_parsers_compile_the_whole_module_at_once(parser, monkeypatch):
+    compiled = []
+
+    def counting_compile(*args, **kwargs):
+        compiled.append(args[2])
+        return compile(*args, **kwargs)
+
+    monkeypatch.setattr(
+        'safeparser.parser.compile', counting_compile, raising=False
+    )
+
+    parser.parse(textwrap.dedent('''
+        a = 0
+        b = [a]
+        c = {'b': b}
+    '''))
+
+    assert compiled == ['exec']
+    assert parser.env == {'a': 0, 'b': [0], 'c': {'b': [0]}}
+
+
+def test_errors_keep_the_statements_executed_before_them(parser):
+    with pytest.raises(ParserException) as info:
+        parser.parse(textwrap.dedent('''
+            a = 0
+            b = 1
+            c = fn()
+            d = 2
+        '''))
+
+    assert str(info.value) == 'l.4: Unknown plugin fn'
+    assert parser.env == {'a': 0, 'b': 1}
+
+
+def test_existing_variables_are_checked_before_calling_plugins(parser):
+    calls = []
+
+    @parser.plugin_store.register
+    def fn():
+        calls.append(0)
+
+    with pytest.raises(ParserException) as info:
+        parser.parse(textwrap.dedent('''
+            a = fn()
+            a = fn()
+        '''))
+
+    assert str(info.value) == 'l.3: Illegal assignment into existing variable a'
+    assert calls == [0]
+
+
+def test_plugins_take_precedence_over_variables():
+    parser = Parser(env={'fn': 0})
+    parser.plugin_store.add(lambda: 1, 'fn')
+
+    parser.parse('a = fn()')
+
+    assert parser.env == {'fn': 0, 'a': 1}
+
+
+def test_process_stmt_is_called_once_per_statement():
+    class MyParser(Parser):
+        def process_stmt(self, stmt):
+            self.seen.append((stmt.lineno, dict(SafeEnv(self.env).items())))
+
+    parser = MyParser()
+    parser.seen = []
+
+    parser.parse(textwrap.dedent('''
+        a = 0
+        b = 1
+    '''))
+
+    assert parser.seen == [(2, {}), (3, {'a': 0})]
+    assert parser.env == {'a': 0, 'b': 1}
+
+
+@pytest.mark.parametrize('program_cache', [None, ProgramCache()])
+def test_overridden_execute_and_prepare_environment_are_called(program_cache):
+    class MyParser(Parser):
+        calls = []
+
+        def prepare_environment(self):
+            self.calls.append('prepare_environment')
+            super().prepare_environment()
+
+        def execute(self, root):
+            self.calls.append('execute')
+            super().execute(root)
+
+    parser = MyParser(program_cache=program_cache)
+
+    assert parser.parse('a = 1') == {'a': 1}
+    assert parser.calls == ['prepare_environment', 'execute']
+
+
+class StatementParser(Parser):
+    def process_stmt(self, stmt):
+        pass
+
+
+def test_statement_parsers_do_not_leak_builtins():
+    parser = StatementParser()
+
+    with pytest.raises(ParserException):
+        parser.parse('a = [len]')
+
+    assert parser.env == {}
+
+
+def test_statement_parsers_see_variables_assigned_by_plugins():
+    parser = StatementParser(env={'fn': 0})
+
+    @parser.plugin_store.register
+    def fn(*, env):
+        env['b'] = 1
+        return 2
+
+    parser.parse(textwrap.dedent('''
+        a = fn()
+        c = [a, b, fn]
+    '''))
+
+    assert parser.env == {'fn': 0, 'a': 2, 'b': 1, 'c': [2, 1, fn]}
+
+
+def test_parsers_call_plugins_wrapped_with_functools_wraps(parser):
+    def lookup(conn, key):
+        return conn, key
+
+    @parser.plugin_store.register(name='lookup')
+    @functools.wraps(lookup)
+    def wrapper(*args, **kwargs):
+        return lookup('CONN', *args, **kwargs)
+
+    assert parser.parse('x = lookup("k")') == {'x': ('CONN', 'k')}
+
+
+def test_nested_plugins_have_access_to_the_env(parser):
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    parser.plugin_store.add(list)
+
+    parser.parse(textwrap.dedent('''
+        a = 0
+        b = list([count()])
+    '''))
+
+    assert parser.env == {'a': 0, 'b': [1]}
+
+
+def test_cannot_overwrite_variables_from_a_previous_parse(parser):
+    parser.parse('a = 0')
+
+    with pytest.raises(ParserException) as info:
+        parser.parse(textwrap.dedent('''
+            b = 1
+            a = 2
+        '''))
+
+    assert str(info.value) == 'l.3: Illegal assignment into existing variable a'
+    assert parser.env == {'a': 0, 'b': 1}
+
+
+def test_cannot_overwrite_variables_created_by_plugins(parser):
+    @parser.plugin_store.register
+    def fn(*, env):
+        env['a'] = 0
+
+    with pytest.raises(ParserException) as info:
+        parser.parse(textwrap.dedent('''
+            fn()
+            a = 1
+        '''))
+
+    assert str(info.value) == 'l.3: Illegal assignment into existing variable a'
+    assert parser.env == {'a': 0}
+
+
+@pytest.fixture
+def count_parse_root(monkeypatch):
+    calls = []
+    original = Parser.parse_root
+
+    def counting_parse_root(self, content):
+        calls.append(content)
+        return original(self, content)
+
+    monkeypatch.setattr(Parser, 'parse_root', counting_parse_root)
+
+    return calls
+
+
+def test_cached_programs_are_not_parsed_again(count_parse_root):
+    cache = ProgramCache()
+
+    assert Parser(program_cache=cache).parse('a = 0') == {'a': 0}
+    assert Parser(program_cache=cache).parse('a = 0') == {'a': 0}
+
+    assert count_parse_root == ['a = 0']
+    assert cache.stats()['hits'] == 1
+
+
+def test_cached_programs_depend_on_the_plugins(count_parse_root):
+    cache = ProgramCache()
+
+    parser = Parser(program_cache=cache)
+
+    with pytest.raises(ParserException):
+        parser.parse('a = fn()')
+
+    parser.plugin_store.add(lambda: 0, 'fn')
+
+    assert parser.parse('a = fn()') == {'a': 0}
+    assert len(count_parse_root) == 2
+
+
+def test_cached_programs_depend_on_the_parser_class(count_parse_root):
+    class TupleToList(ast.NodeTransformer):
+        def visit_Tuple(self, node):
+            return ast.copy_location(ast.List(
+                elts=[self.visit(elt) for elt in node.elts],
+                ctx=ast.Load(),
+            ), node)
+
+    class MyParser(Parser):
+        def process_root(self, root):
+            TupleToList().visit(root)
+
+    cache = ProgramCache()
+
+    assert Parser(program_cache=cache).parse('a = (0,)') == {'a': (0,)}
+    assert MyParser(program_cache=cache).parse('a = (0,)') == {'a': [0]}
+
+
+def test_cached_programs_cannot_overwrite_variables():
+    cache = ProgramCache()
+    content = textwrap.dedent('''
+        a = 0
+        b = 1
+    ''')
+
+    Parser(program_cache=cache).parse(content)
+
+    parser = Parser(env={'b': 2}, program_cache=cache)
+
+    with pytest.raises(ParserException) as info:
+        parser.parse(content)
+
+    assert str(info.value) == 'l.3: Illegal assignment into existing variable b'
+    assert parser.env == {'a': 0, 'b': 2}
+
+
+def double(x):
+    return 2 * x
+
+
+def test_parsers_can_parse_many_inputs_in_parallel():
+    parser = Parser(env={'base': 1})
+    parser.plugin_store.add(double)
+
+    results = list(parser.parse_many(
+        ['a = double(base)', 'a = base', 'a = unknown()', 'base = 0'],
+        workers=2,
+    ))
+
+    assert results[0] == {'base': 1, 'a': 2}
+    assert results[1] == {'base': 1, 'a': 1}
+    assert isinstance(results[2], ParserException)
+    assert isinstance(results[3], ParserException)
+    assert parser.env == {'base': 1}
+
+
+def test_parse_many_can_yield_results_as_they_are_available():
+    parser = Parser()
+    parser.plugin_store.add(double)
+
+    inputs = [f'a = double({i})' for i in range(10)]
+
+    results = dict(parser.parse_many(
+        inputs, workers=2, chunksize=3, ordered=False
+    ))
+
+    assert results == {i: {'a': 2 * i} for i in range(10)}
+
+
+def test_parse_many_works_with_program_caches():
+    parser = Parser(program_cache=ProgramCache())
+
+    results = list(parser.parse_many(['a = 0', 'a = 0'], workers=1))
+
+    assert results == [{'a': 0}, {'a': 0}]
+
+
+def test_parsers_can_parse_streams(parser, tmp_path):
+    path = tmp_path / 'tmp.txt'
+    path.write_text(textwrap.dedent('''
+        a = 0
+        b = [
+            a,
+            1,
+        ]
+    '''))
+
+    with path.open() as f:
+        assert parser.parse_stream(f) == {'a': 0, 'b': [0, 1]}
+
+
+def test_parsers_can_parse_binary_streams(parser):
+    assert parser.parse_stream(io.BytesIO(b'a = 0\nb = [\n1]\n')) == {
+        'a': 0,
+        'b': [1],
+    }
+
+    with pytest.raises(ParserException):
+        parser.parse_stream(io.BytesIO(b'c = 1\nd = "\xff"\n'))
+
+    assert parser.env == {'a': 0, 'b': [1], 'c': 1}
+
+
+def test_streams_are_executed_while_being_read(parser):
+    read = []
+
+    @parser.plugin_store.register
+    def lines_read():
+        return len(read)
+
+    class Reader:
+        lines = iter(['a = lines_read()\n', 'b = lines_read()\n', ''])
+
+        def readline(self):
+            line = next(self.lines)
+            read.append(line)
+            return line
+
+    parser.parse_stream(Reader())
+
+    assert parser.env == {'a': 1, 'b': 2}
+
+
+def test_stream_errors_report_lines_of_the_original_input(parser):
+    content = textwrap.dedent('''
+        a = 0
+        b = [
+            a,
+        ]
+        c = 1 + 1
+    ''')
+
+    with pytest.raises(ParserException) as info:
+        parser.parse_stream(content)
+
+    assert str(info.value) == 'l.6: Illegal syntax'
+    assert parser.env == {'a': 0, 'b': [0]}
+
+
+def test_stream_syntax_errors_report_lines_of_the_original_input(parser):
+    with pytest.raises(ParserException) as info:
+        parser.parse_stream('a = 0\nb = 1\nc d\n')
+
+    assert info.value.args[0].lineno == 3
+
+
+def test_streams_with_unterminated_statements_are_rejected(parser):
+    with pytest.raises(ParserException):
+        parser.parse_stream('a = 0\nb = [\n')
+
+    assert parser.env == {'a': 0}
+
+
+def test_parsers_can_parse_asynchronously(parser):
+    @parser.plugin_store.register
+    async def fetch(x):
+        await asyncio.sleep(0)
+        return [x]
+
+    parser.plugin_store.add(len)
+
+    env = asyncio.run(parser.aparse(textwrap.dedent('''
+        a = fetch(0)
+        b = {'a': a, 'b': fetch(len(a))}
+    ''')))
+
+    assert env == {'a': [0], 'b': {'a': [0], 'b': [1]}}
+
+
+def test_independent_async_plugins_run_concurrently(parser):
+    event = asyncio.Event()
+
+    @parser.plugin_store.register
+    async def wait():
+        await asyncio.wait_for(event.wait(), 1)
+        return 'waited'
+
+    @parser.plugin_store.register
+    async def notify():
+        event.set()
+        return 'notified'
+
+    asyncio.run(parser.aparse('a = [wait(), notify()]'))
+
+    assert parser.env == {'a': ['waited', 'notified']}
+
+
+def test_async_parsing_can_offload_sync_plugins_to_threads(parser):
+    @parser.plugin_store.register
+    def thread():
+        return threading.get_ident()
+
+    asyncio.run(parser.aparse('a = thread()'))
+    asyncio.run(parser.aparse('b = thread()', offload=True))
+
+    assert parser.env['a'] == threading.get_ident()
+    assert parser.env['b'] != threading.get_ident()
+
+
+def test_async_parsing_keeps_the_parser_semantics():
+    class MyParser(Parser):
+        def process_stmt(self, stmt):
+            self.seen.append(stmt.lineno)
+
+    parser = MyParser()
+    parser.seen = []
+
+    @parser.plugin_store.register
+    async def count(*, env):
+        return len(env)
+
+    with pytest.raises(ParserException) as info:
+        asyncio.run(parser.aparse(textwrap.dedent('''
+            a = count()
+            b = [count()]
+            a = 0
+        ''')))
+
+    assert str(info.value) == 'l.4: Illegal assignment into existing variable a'
+    assert parser.env == {'a': 0, 'b': [1]}
+    assert parser.seen == [2, 3, 4]
+
+    with pytest.raises(ParserException):
+        asyncio.run(parser.aparse('c = unknown()'))
+
+    with pytest.raises(ParserException):
+        asyncio.run(parser.aparse('c = [unknown()]'))
+
+
+def test_async_parsers_call_variables_as_parse_does():
+    def fn(x):
+        return x + 1
+
+    content = 'a = [v(1)]'
+
+    assert Parser(env={'v': fn}).parse(content) == {'v': fn, 'a': [2]}
+    assert asyncio.run(Parser(env={'v': fn}).aparse(content)) == {
+        'v': fn,
+        'a': [2],
+    }
+
+
+def test_independent_statements_run_concurrently(parser):
+    barrier = threading.Barrier(2, timeout=1)
+
+    @parser.plugin_store.register
+    def meet(x):
+        barrier.wait()
+        return x
+
+    @parser.plugin_store.register
+    def pair(a, b):
+        return (a, b)
+
+    with ThreadPoolExecutor(2) as executor:
+        parser.parse_parallel(textwrap.dedent('''
+            a = meet(0)
+            b = meet(1)
+            c = pair(a, b)
+        '''), executor)
+
+    assert parser.env == {'a': 0, 'b': 1, 'c': (0, 1)}
+
+
+def test_plugins_that_take_the_env_wait_for_previous_statements(parser):
+    @parser.plugin_store.register
+    def slow(x):
+        time.sleep(0.05)
+        return x
+
+    @parser.plugin_store.register
+    def names(*, env):
+        return sorted(env)
+
+    with ThreadPoolExecutor(4) as executor:
+        parser.parse_parallel(textwrap.dedent('''
+            a = slow(0)
+            b = slow(1)
+            c = names()
+            d = slow(c)
+        '''), executor)
+
+    assert parser.env['c'] == ['a', 'b']
+    assert parser.env['d'] == ['a', 'b']
+
+
+def test_parallel_parsing_raises_the_earliest_error(parser):
+    @parser.plugin_store.register
+    def fail(delay):
+        time.sleep(delay)
+        raise ValueError(delay)
+
+    @parser.plugin_store.register
+    def ok():
+        return 0
+
+    with ThreadPoolExecutor(4) as executor:
+        with pytest.raises(ValueError) as info:
+            parser.parse_parallel(textwrap.dedent('''
+                a = fail(0.05)
+                b = ok()
+                c = fail(0)
+            '''), executor)
+
+    assert info.value.args == (0.05,)
+    assert parser.env == {'b': 0}
+
+
+def test_parallel_parsing_keeps_the_parser_checks(parser):
+    parser.plugin_store.add(double)
+
+    with ThreadPoolExecutor(2) as executor:
+        with pytest.raises(ParserException) as info:
+            parser.parse_parallel(textwrap.dedent('''
+                a = double(1)
+                a = double(2)
+            '''), executor)
+
+        assert str(info.value) == 'l.3: Illegal assignment into existing variable a'
+        assert parser.env == {'a': 2}
+
+        with pytest.raises(ParserException):
+            parser.parse_parallel('b = [double(unknown)]', executor)
+
+
+def test_parallel_parsing_processes_statements_before_scheduling_them():
+    class LoggingParser(Parser):
+        def process_stmt(self, stmt):
+            # Wrap each value in a call to a plugin that takes the env
+            stmt.value = ast.copy_location(
+                ast.Call(ast.Name('log', ast.Load()), [stmt.value], []),
+                stmt.value,
+            )
+            ast.fix_missing_locations(stmt)
+
+    parser = LoggingParser()
+    parser.plugin_store.add(double)
+
+    @parser.plugin_store.register
+    def log(value, *, env):
+        return [value, len(env)]
+
+    with ThreadPoolExecutor(2) as executor:
+        parser.parse_parallel('a = double(1)\nb = double(2)', executor)
+
+    assert parser.env == {'a': [2, 0], 'b': [4, 1]}
+
+
+def test_parallel_parsing_can_use_processes(parser):
+    parser.plugin_store.add(double)
+
+    with ProcessPoolExecutor(2) as executor:
+        parser.parse_parallel(textwrap.dedent('''
+            a = double(1)
+            b = double(a)
+            c = [a, b]
+        '''), executor)
+
+    assert parser.env == {'a': 2, 'b': 4, 'c': [2, 4]}
+
+
+def test_pure_plugins_are_memoized_across_parses(parser):
+    calls = []
+
+    @parser.plugin_store.register(pure=True)
+    def pairs(items):
+        calls.append(items)
+        return [(a, b) for a in items for b in items if a < b]
+
+    parser.parse('a = pairs([1, 2])')
+    parser.parse('b = pairs([1, 2])')
+
+    assert parser.env == {'a': [(1, 2)], 'b': [(1, 2)]}
+    assert calls == [[1, 2]]
+
+
+def test_lazy_parsers_only_evaluate_variables_that_are_read(parser):
+    calls = []
+
+    @parser.plugin_store.register
+    def fn(x):
+        calls.append(x)
+        return x
+
+    env = parser.parse_lazy(textwrap.dedent('''
+        a = fn(0)
+        b = fn([a])
+        c = fn(2)
+    '''))
+
+    assert calls == []
+    assert len(env) == 3
+    assert 'c' in env
+
+    assert env['b'] == [0]
+    assert calls == [0, [0]]
+
+    assert env['b'] == [0]
+    assert calls == [0, [0]]
+
+
+def test_lazy_parsers_execute_side_effects_eagerly(parser):
+    calls = []
+
+    @parser.plugin_store.register
+    def fn(x):
+        calls.append(x)
+        return x
+
+    @parser.plugin_store.register
+    def total(*, env):
+        return sum(value for key, value in env.items() if key != 'c')
+
+    @parser.plugin_store.register
+    def log(x):
+        calls.append(('log', x))
+
+    env = parser.parse_lazy(textwrap.dedent('''
+        a = fn(1)
+        b = fn(2)
+        c = fn(3)
+        d = total()
+        log(c)
+    '''))
+
+    assert calls == [1, 2, 3, ('log', 3)]
+    assert env['d'] == 3
+
+
+def test_lazy_parsers_evaluate_deferred_variables_before_env_changes(parser):
+    @parser.plugin_store.register
+    def ident(x):
+        return x
+
+    @parser.plugin_store.register
+    def bump(*, env):
+        env['a'] = 2
+
+    @parser.plugin_store.register
+    def drop(*, env):
+        del env['c']
+
+    env = parser.parse_lazy(textwrap.dedent('''
+        a = 1
+        b = ident(a)
+        bump()
+        c = 3
+        d = [c]
+        e = drop()
+    '''))
+
+    assert env['b'] == 1
+    assert env['d'] == [3]
+    assert 'c' not in env
+
+
+def test_lazy_parsers_report_errors_while_parsing(parser):
+    with pytest.raises(ParserException) as info:
+        parser.parse_lazy(textwrap.dedent('''
+            a = 0
+            b = [a, c]
+        '''))
+
+    assert str(info.value) == "l.3: name 'c' is not defined"
+
+    with pytest.raises(ParserException):
+        parser.parse_lazy('a = 1')
+
+
+def test_lazy_parsers_resolve_long_chains_of_variables(parser):
+    content = '\n'.join(
+        ['a0 = 0'] + [f'a{i} = [a{i - 1}]' for i in range(1, 5000)]
+    )
+
+    env = parser.parse_lazy(content)
+
+    value = env['a4999']
+    for _ in range(4999):
+        value, = value
+
+    assert value == 0
+
+
+def test_lazy_environments_can_be_parsed_again(parser):
+    parser.parse_lazy('a = 0')
+    parser.parse('b = [a]')
+
+    assert dict(parser.env) == {'a': 0, 'b': [0]}
+
+
+def test_budgets_limit_the_size_of_the_source(tmp_path):
+    parser = Parser(budget=Budget(max_source_bytes=10))
+
+    with pytest.raises(BudgetExceeded):
+        parser.parse('a = "0123456789"')
+
+    path = tmp_path / 'tmp.txt'
+    path.write_text('a = 0\n' * 100)
+
+    with path.open() as f:
+        with pytest.raises(BudgetExceeded):
+            parser.parse(f)
+
+    with path.open() as f:
+        with pytest.raises(BudgetExceeded):
+            parser.parse_stream(f)
+
+    assert parser.env == {'a': 0}
+
+
+def test_binary_files_can_be_cached_and_budgeted():
+    parser = Parser(
+        program_cache=ProgramCache(), budget=Budget(max_source_bytes=10)
+    )
+
+    assert parser.parse(io.BytesIO(b'a = 1')) == {'a': 1}
+    assert parser.parse(io.BytesIO(b'b = 2'), env={}) == {'b': 2}
+
+    with pytest.raises(BudgetExceeded):
+        parser.parse(io.BytesIO(b'c = "0123456789"'))
+
+
+def test_budgets_limit_the_number_and_depth_of_nodes():
+    parser = Parser(budget=Budget(max_nodes=10, max_depth=6))
+
+    parser.parse('a = [[0]]')
+
+    with pytest.raises(BudgetExceeded):
+        parser.parse('b = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]')
+
+    with pytest.raises(BudgetExceeded):
+        parser.parse('b = [[[[[0]]]]]')
+
+    assert parser.env == {'a': [[0]]}
+
+
+def test_cached_programs_are_not_reused_under_other_node_limits():
+    cache = ProgramCache()
+    content = 'a = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]'
+
+    Parser(program_cache=cache).parse(content)
+
+    with pytest.raises(BudgetExceeded):
+        Parser(program_cache=cache, budget=Budget(max_nodes=5)).parse(content)
+
+    with pytest.raises(BudgetExceeded):
+        Parser(program_cache=cache, budget=Budget(max_depth=1)).parse(content)
+
+
+def test_budgets_limit_the_time_of_plugin_calls():
+    parser = Parser(budget=Budget(plugin_timeout=0.05))
+
+    @parser.plugin_store.register
+    def slow(x):
+        time.sleep(x)
+        return x
+
+    parser.parse('a = slow(0)')
+
+    start = time.monotonic()
+
+    with pytest.raises(BudgetExceeded, match='Plugin slow exceeded'):
+        parser.parse('b = [slow(1)]')
+
+    assert time.monotonic() - start < 0.5
+    assert parser.env == {'a': 0}
+
+
+def test_budgets_report_plugin_calls_cut_short_by_the_parse_timeout():
+    parser = Parser(budget=Budget(timeout=0.05, plugin_timeout=1))
+
+    @parser.plugin_store.register
+    def slow(x):
+        time.sleep(x)
+
+    with pytest.raises(BudgetExceeded, match='Parsing exceeded 0.05 seconds'):
+        parser.parse('slow(1)')
+
+
+def test_budgets_limit_the_time_of_parsing():
+    parser = Parser(budget=Budget(timeout=0.1))
+
+    @parser.plugin_store.register
+    def slow():
+        time.sleep(0.04)
+
+    start = time.monotonic()
+
+    with pytest.raises(BudgetExceeded):
+        parser.parse('\n'.join(f'a{i} = slow()' for i in range(100)))
+
+    assert time.monotonic() - start < 0.5
+
+
+def test_budgets_limit_the_size_of_values():
+    parser = Parser(budget=Budget(max_value_size=10))
+
+    @parser.plugin_store.register
+    def repeat(x, n):
+        return [x] * n
+
+    parser.parse('a = repeat(0, 5)')
+
+    with pytest.raises(BudgetExceeded):
+        parser.parse('b = repeat(0, 6)')
+
+    with pytest.raises(BudgetExceeded):
+        StatementParser(
+            env=parser.env,
+            plugin_store=parser.plugin_store,
+            budget=parser.budget,
+        ).parse('b = repeat("xx", 4)')
+
+    assert parser.env == {'a': [0] * 5}
+
+
+def test_budgets_keep_the_env_of_plugins():
+    parser = Parser(budget=Budget(timeout=1))
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    parser.parse(textwrap.dedent('''
+        a = count()
+        b = [count()]
+    '''))
+
+    assert parser.env == {'a': 0, 'b': [1]}
+
+
+@pytest.mark.parametrize('cls', [Parser, StatementParser])
+def test_stats_measure_phases_statements_and_plugins(cls):
+    stats = ParseStats()
+    parser = cls(stats=stats)
+
+    @parser.plugin_store.register
+    def slow(x):
+        time.sleep(0.01)
+        return x
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    parser.parse(textwrap.dedent('''\
+        a = slow(1)
+        b = [slow(2), count()]
+        c = a
+    '''))
+
+    assert parser.env == {'a': 1, 'b': [2, 1], 'c': 1}
+
+    result = stats.as_dict()
+
+    assert {'read', 'parse', 'validate', 'process_root', 'execute'} <= set(
+        result['phases']
+    )
+    assert [s['lineno'] for s in result['statements']] == [1, 2, 3]
+    assert result['statements'][0]['duration'] >= 0.01
+    assert result['plugins']['slow']['calls'] == 2
+    assert result['plugins']['slow']['max'] >= 0.01
+    assert result['plugins']['count']['calls'] == 1
+
+
+def test_stats_measure_failing_statements():
+    stats = ParseStats()
+    parser = Parser(env={'b': 0}, stats=stats)
+
+    with pytest.raises(ParserException):
+        parser.parse('a = 1\nb = 2')
+
+    assert [lineno for lineno, _ in stats.statements] == [1, 2]
+
+
+def test_stats_do_not_share_cached_programs():
+    cache = ProgramCache()
+
+    Parser(program_cache=cache).parse('a = 1')
+
+    stats = ParseStats()
+    Parser(program_cache=cache, stats=stats).parse('a = 1')
+
+    assert [lineno for lineno, _ in stats.statements] == [1]
+    assert 'compile' in stats.phases
+
+
+def test_parsers_do_not_modify_the_env_to_execute_content():
+    class RecordingDict(dict):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.writes = []
+
+        def __setitem__(self, key, value):
+            self.writes.append(key)
+            super().__setitem__(key, value)
+
+        def __delitem__(self, key):
+            self.writes.append(key)
+            super().__delitem__(key)
+
+    env = RecordingDict({'a': 1})
+    parser = Parser(env=env)
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    parser.parse('b = count()\nc = [a, b]')
+
+    assert env.writes == ['b', 'c']
+    assert env == {'a': 1, 'b': 1, 'c': [1, 1]}
+
+
+def test_parsers_accept_read_only_envs():
+    env = types.MappingProxyType({'a': 1})
+    parser = Parser(env=env)
+
+    @parser.plugin_store.register
+    def keys(*, env):
+        return list(env)
+
+    parser.parse('keys()\nkeys()')
+
+    with pytest.raises(TypeError):
+        parser.parse('b = a')
+
+
+def test_plugins_see_the_current_env_across_parses():
+    parser = Parser(env={'a': 1, '__hidden__': 0})
+
+    @parser.plugin_store.register
+    def names(*, env):
+        return sorted(env)
+
+    parser.parse('b = names()')
+    del parser.env['__hidden__']
+    parser.env['c'] = 2
+    parser.parse('d = names()')
+
+    assert parser.env['b'] == ['a']
+    assert parser.env['d'] == ['a', 'b', 'c']
+
+    parser.env = {}
+    parser.parse('e = names()')
+
+    assert parser.env == {'e': []}
+
+
+@pytest.mark.parametrize('content', [
+    'a = b"bytes"',
+    'a = ...',
+    'a = {**b}',
+    'a = [*b]',
+    'a = f(*b)',
+])
+def test_parsers_reject_other_constants_and_unpacking(parser, content):
+    parser.plugin_store.add(list, 'f')
+
+    with pytest.raises(ParserException):
+        parser.parse(content)
+
+
+def test_parsers_accept_every_kind_of_constant(parser):
+    parser.parse('a = [1, 1.5, 1j, "x", True, None]')
+
+    assert parser.env['a'] == [1, 1.5, 1j, 'x', True, None]
+
+
+@pytest.mark.parametrize('budget', [None, Budget(max_nodes=100_000)])
+def test_validators_handle_deeply_nested_trees(budget):
+    # The parser of python limits the nesting of the source code, but
+    # `process_root` and other tools may build deeper trees
+    value = ast.Constant(0)
+    for _ in range(10_000):
+        value = ast.List(elts=[value], ctx=ast.Load())
+
+    root = ast.Module(
+        body=[ast.Assign(targets=[ast.Name('a', ast.Store())], value=value)],
+        type_ignores=[],
+    )
+
+    SafeCodeValidator(PluginStore(), budget).visit(root)
+
+    with pytest.raises(BudgetExceeded):
+        SafeCodeValidator(PluginStore(), Budget(max_depth=100)).visit(root)
+
+
+class UpperCase(NodeHook):
+    def visit_Constant(self, node):
+        if isinstance(node.value, str):
+            node.value = node.value.upper()
+
+
+class NoSets(NodeHook):
+    def visit_Set(self, node):
+        raise ParserException(f'l.{node.lineno}: Sets are not allowed')
+
+
+class Rename(NodeHook):
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id == 'alias':
+            node.func.id = 'count'
+
+
+class MakeAttribute(NodeHook):
+    def visit_Call(self, node):
+        node.func = ast.Attribute(node.func, 'attr', ast.Load())
+
+
+@pytest.mark.parametrize('cls', [Parser, StatementParser])
+def test_hooks_check_and_transform_nodes(cls):
+    parser = cls(hooks=[UpperCase(), NoSets(), Rename()])
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    parser.parse('a = ["x", ("y", "z")]\nb = alias()')
+
+    assert parser.env == {'a': ['X', ('Y', 'Z')], 'b': 1}
+
+    with pytest.raises(ParserException) as info:
+        parser.parse('c = 1\nd = [{1}]')
+
+    assert 'l.2: Sets are not allowed' in str(info.value)
+    assert 'c' not in parser.env
+
+
+def test_hooks_run_before_validation():
+    parser = Parser(hooks=[MakeAttribute()])
+    parser.plugin_store.add(list)
+
+    with pytest.raises(ParserException):
+        parser.parse('a = list()')
+
+
+def test_cached_programs_depend_on_the_hooks():
+    cache = ProgramCache()
+
+    Parser(program_cache=cache).parse('a = "x"')
+    parser = Parser(program_cache=cache, hooks=[UpperCase()])
+    parser.parse('a = "x"')
+
+    assert parser.env == {'a': 'X'}
+
+
+def test_parsers_walk_the_content_once(monkeypatch):
+    visits = []
+    original = EnvironmentInjector.visit
+
+    def visit(self, node):
+        visits.append(node)
+        return original(self, node)
+
+    monkeypatch.setattr(EnvironmentInjector, 'visit', visit)
+
+    parser = Parser()
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    parser.parse('a = count()\nb = [count(), a]\ncount()')
+
+    assert parser.env == {'a': 0, 'b': [1, 0]}
+    assert visits == []
+
+
+def test_parsers_inject_the_env_into_calls_added_by_process_root():
+    class AddCalls(Parser):
+        def process_root(self, root):
+            for stmt in root.body:
+                func = ast.copy_location(
+                    ast.Name('count', ast.Load()), stmt.value
+                )
+                stmt.value = ast.copy_location(
+                    ast.Call(func=func, args=[], keywords=[]), stmt.value
+                )
+
+    parser = AddCalls()
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    parser.parse('a = 0\nb = 0')
+
+    assert parser.env == {'a': 0, 'b': 1}
+
+
+def test_parsers_reject_an_explicit_env_for_plugins_that_take_it(parser):
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    with pytest.raises(ParserException):
+        parser.parse('a = count(env=[])')
+
+
+@pytest.mark.parametrize('cls', [Parser, StatementParser])
+def test_forked_parsers_do_not_modify_the_base_env(cls):
+    base = {'a': 1, 'shared': [1]}
+    parser = cls(env=base)
+
+    @parser.plugin_store.register
+    def edit(*, env):
+        env['a'] = 2
+        del env['shared']
+
+    fork = parser.fork()
+    fork.parse('b = a\nedit()\nc = [a, b]')
+
+    assert base == {'a': 1, 'shared': [1]}
+    assert dict(fork.env) == {'a': 2, 'b': 1, 'c': [2, 1]}
+    assert fork.plugin_store is parser.plugin_store
+
+    # The same content can be parsed again over the base
+    other = parser.fork()
+    other.parse('b = a')
+
+    assert dict(other.env) == {'a': 1, 'shared': [1], 'b': 1}
+
+
+def test_forked_parsers_can_be_used_from_several_threads():
+    parser = Parser(env={f'var{i}': i for i in range(1000)})
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    def work(i):
+        fork = parser.fork()
+        fork.parse(f'result = [var{i}, count()]')
+
+        return fork.env['result']
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(work, range(100)))
+
+    assert results == [[i, 1000] for i in range(100)]
+    assert len(parser.env) == 1000
+
+
+def test_disk_cached_programs_are_not_parsed_in_later_processes(
+    tmp_path, count_parse_root
+):
+    content = 'a = [1, 2]\nb = list(a)'
+
+    def make_parser():
+        parser = Parser(program_cache=DiskProgramCache(tmp_path))
+        parser.plugin_store.add(list)
+
+        return parser
+
+    assert make_parser().parse(content) == {'a': [1, 2], 'b': [1, 2]}
+
+    # A new cache on the same directory stands for a restarted process
+    parser = make_parser()
+
+    assert parser.parse(content) == {'a': [1, 2], 'b': [1, 2]}
+    assert count_parse_root == [content]
+    assert parser.program_cache.stats()['disk_hits'] == 1
+
+
+def test_disk_cached_programs_depend_on_the_plugins(tmp_path):
+    with pytest.raises(ParserException):
+        Parser(program_cache=DiskProgramCache(tmp_path)).parse('a = f()')
+
+    parser = Parser(program_cache=DiskProgramCache(tmp_path))
+    parser.plugin_store.add(lambda: 1, 'f')
+
+    assert parser.parse('a = f()') == {'a': 1}
+    assert parser.program_cache.stats()['disk_hits'] == 0
+
+
+def test_parsers_can_parse_into_a_given_env():
+    parser = Parser(env={'a': 0})
+
+    @parser.plugin_store.register
+    def names(*, env):
+        return sorted(env)
+
+    env = parser.parse('b = a\nc = names()', env={'a': 1})
+
+    assert env == {'a': 1, 'b': 1, 'c': ['a', 'b']}
+    assert parser.env == {'a': 0}
+
+    with pytest.raises(AttributeError):
+        parser.namespace
+
+
+def test_plugins_can_parse_with_the_same_parser():
+    parser = Parser()
+
+    @parser.plugin_store.register
+    def nested(content):
+        return parser.parse(content, env={})['x']
+
+    parser.parse('a = nested("x = [1]")\nb = a')
+
+    assert parser.env == {'a': [1], 'b': [1]}
+
+
+@pytest.mark.parametrize('cls', [Parser, StatementParser])
+def test_parsers_can_be_shared_by_several_threads(cls):
+    stats = ParseStats()
+    parser = cls(stats=stats, budget=Budget(timeout=10))
+
+    @parser.plugin_store.register
+    def count(*, env):
+        time.sleep(0)
+        return len(env)
+
+    @parser.plugin_store.register
+    def pair(x, y):
+        time.sleep(0)
+        return [x, y]
+
+    content = textwrap.dedent('''\
+        a = pair(seed, count())
+        b = [a, count()]
+        c = pair(b, seed)
+    ''')
+
+    def work(i):
+        return parser.parse(content, env={'seed': i})
+
+    threads, parses = 16, 50
+
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(work, range(threads * parses)))
+
+    for i, env in enumerate(results):
+        assert env == {
+            'seed': i,
+            'a': [i, 1],
+            'b': [[i, 1], 2],
+            'c': [[[i, 1], 2], i],
+        }
+
+    assert parser.env == {}
+    assert len(stats.statements) == 3 * threads * parses
+    assert stats.plugins['count']['calls'] == 2 * threads * parses
+
+
+def test_parsers_can_be_shared_by_several_tasks():
+    parser = Parser()
+
+    @parser.plugin_store.register
+    async def pause(x):
+        await asyncio.sleep(0)
+        return x
+
+    @parser.plugin_store.register
+    def count(*, env):
+        return len(env)
+
+    async def main():
+        return await asyncio.gather(*(
+            parser.aparse(
+                'a = pause(seed)\nb = [pause(a), count()]', env={'seed': i}
+            )
+            for i in range(20)
+        ))
+
+    results = asyncio.run(main())
+
+    assert results == [{'seed': i, 'a': i, 'b': [i, 2]} for i in range(20)]
+    assert parser.env == {}
+
+
+def test_parsers_only_load_the_lazy_plugins_they_call(tmp_path, monkeypatch):
+    for name in ['used', 'unused']:
+        (tmp_path / f'lazy_{name}.py').write_text(
+            'def fn(x, *, env):\n'
+            '    return [x, len(env)]\n'
+        )
+        monkeypatch.delitem(sys.modules, f'lazy_{name}', raising=False)
+
+    monkeypatch.syspath_prepend(tmp_path)
+
+    parser = Parser(program_cache=ProgramCache())
+    parser.plugin_store.add_lazy('lazy_used:fn', 'used')
+    parser.plugin_store.add_lazy('lazy_unused:fn', 'unused')
+
+    with pytest.raises(ParserException):
+        parser.parse('unused = 1')
+
+    parser.parse('a = used(1)')
+
+    assert parser.env == {'a': [1, 0]}
+    assert 'lazy_used' in sys.modules
+    assert 'lazy_unused' not in sys.modules
+
+
+def test_iter_parse_yields_each_assignment_as_it_executes(parser):
+    calls = []
+
+    @parser.plugin_store.register
+    def record(x):
+        calls.append(x)
+        return x
+
+    results = parser.iter_parse(textwrap.dedent('''\
+        a = record(1)
+        record(2)
+
+        b = [a, record(3)]
+    '''))
+
+    assert next(results) == ('a', 1, 1)
+    assert calls == [1]
+
+    assert list(results) == [('b', [1, 3], 4)]
+    assert calls == [1, 2, 3]
+    assert parser.env == {'a': 1, 'b': [1, 3]}
+
+
+def test_iter_parse_validates_the_whole_content_first(parser):
+    results = parser.iter_parse('a = 1\nb = [import]')
+
+    with pytest.raises(ParserException):
+        next(results)
+
+    assert parser.env == {}
+
+
+def test_iter_parse_can_release_yielded_variables():
+    parser = Parser(env={'base': 0})
+    seen = []
+
+    @parser.plugin_store.register
+    def names(*, env):
+        return sorted(env)
+
+    results = parser.iter_parse(
+        'a = 1\nb = [a]\nc = [2]\nd = names()\ne = [3]\nf = [e]',
+        release=True,
+    )
+
+    for name, value, lineno in results:
+        seen.append((name, value, sorted(parser.env)))
+
+    assert seen == [
+        ('a', 1, ['a', 'base']),
+        ('b', [1], ['a', 'b', 'base']),
+        ('c', [2], ['a', 'b', 'base', 'c']),
+        ('d', ['a', 'b', 'base', 'c'], ['a', 'b', 'base', 'c', 'd']),
+        ('e', [3], ['base', 'e']),
+        ('f', [[3]], ['base', 'e', 'f']),
+    ]
+    assert parser.env == {'base': 0}
+
+
+def test_iter_parse_keeps_variables_that_are_assigned_again(parser):
+    results = parser.iter_parse('a = 1\nb = 2\na = 3', release=True)
+
+    with pytest.raises(ParserException, match='l.3'):
+        list(results)
+
+
+def test_iter_parse_generators_can_be_interleaved(parser):
+    first = parser.iter_parse('a = 1\nb = [a]', env={})
+    second = parser.iter_parse('a = 2\nb = [a]', env={})
+
+    assert next(first) == ('a', 1, 1)
+    assert next(second) == ('a', 2, 1)
+    assert next(first) == ('b', [1], 2)
+    assert next(second) == ('b', [2], 2)
+    assert parser.env == {}
@@ -0,0 +1,101 @@
+import itertools
+import pickle
+
+import pytest
+
+from safeparser.parser import Parser
+from safeparser.sequences import (
+    Combinations,
+    LazySequence,
+    Pairs,
+    Product,
+    Range,
+    Repeat,
+    register_plugins,
+)
+
+ITEMS = list('abcdefg')
+
+
+@pytest.mark.parametrize('sequence, expected', [
+    (Pairs(ITEMS), list(itertools.combinations(ITEMS, 2))),
+    (Pairs(ITEMS[:1]), []),
+    (Combinations(ITEMS, 3), list(itertools.combinations(ITEMS, 3))),
+    (Combinations(ITEMS, 0), [()]),
+    (Combinations(ITEMS, 8), []),
+    (Product(ITEMS, 'xy'), list(itertools.product(ITEMS, 'xy'))),
+    (Product('ab', repeat=3), list(itertools.product('ab', repeat=3))),
+    (Range(3, 20, 4), list(range(3, 20, 4))),
+    (Repeat('x', 4), ['x'] * 4),
+])
+def test_sequences_behave_like_lists(sequence, expected):
+    assert len(sequence) == len(expected)
+    assert list(sequence) == expected
+    assert [sequence[i] for i in range(len(sequence))] == expected
+    assert [sequence[-i] for i in range(1, len(sequence) + 1)] == [
+        expected[-i] for i in range(1, len(expected) + 1)
+    ]
+
+    for index in [slice(2, None), slice(1, -1, 3), slice(None, None, -2)]:
+        assert list(sequence[index]) == expected[index]
+        assert list(sequence[index][1:]) == expected[index][1:]
+
+    for start in range(len(expected) + 1):
+        assert list(sequence.iter_from(start)) == expected[start:]
+
+    with pytest.raises(IndexError):
+        sequence[len(expected)]
+
+
+def test_sequences_iterate_in_chunks():
+    chunks = list(Pairs(range(5)).chunks(4))
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert sum(chunks, []) == list(itertools.combinations(range(5), 2))
+
+    with pytest.raises(ValueError):
+        next(Pairs(range(5)).chunks(0))
+
+
+def test_sequences_are_compact():
+    pairs = Pairs(Range(50_000))
+
+    assert len(pairs) == 1_249_975_000
+    assert pairs[0] == (0, 1)
+    assert pairs[-1] == (49_998, 49_999)
+    assert pairs[1_000_000_000] == (27_639, 48_620)
+    assert len(pickle.dumps(pairs)) < 1000
+
+    assert Combinations(Range(100), 4)[-1] == (96, 97, 98, 99)
+    assert Product(Range(10**6), repeat=2)[123_456_789] == (123, 456_789)
+
+
+def test_sequences_must_implement_get():
+    class Sized(LazySequence):
+        def __len__(self):
+            return 1
+
+    with pytest.raises(TypeError):
+        Sized()
+
+
+def test_sequences_can_be_used_by_parsers():
+    parser = Parser()
+    register_plugins(parser.plugin_store)
+
+    @parser.plugin_store.register
+    def total(pairs):
+        return sum(a * b for chunk in pairs.chunks(100) for a, b in chunk)
+
+    parser.parse('''
+entities = range(1, 101)
+all = pairs(entities)
+result = total(all)
+grid = product([0, 1], repeat=2)
+''')
+
+    assert len(parser.env['all']) == 4950
+    assert parser.env['result'] == sum(
+        a * b for a, b in itertools.combinations(range(1, 101), 2)
+    )
+    assert list(parser.env['grid']) == [(0, 0), (0, 1), (1, 0), (1, 1)]
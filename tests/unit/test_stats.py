@@ -0,0 +1,60 @@
+from safeparser.stats import ParseStats
+
+
+def test_stats_accumulate_phases():
+    stats = ParseStats()
+
+    with stats.phase('parse'):
+        pass
+
+    stats.record_phase('parse', 1)
+    stats.record_phase('execute', 2)
+
+    assert stats.phases['parse'] >= 1
+    assert stats.phases['execute'] == 2
+
+
+def test_stats_measure_consecutive_statements():
+    stats = ParseStats()
+
+    stats.start_statement(1)
+    stats.start_statement(3)
+    stats.end_statement()
+    stats.end_statement()
+
+    assert [lineno for lineno, _ in stats.statements] == [1, 3]
+
+
+def test_stats_measure_plugin_calls():
+    stats = ParseStats()
+
+    def call_plugin(identifier, plugin, *args, **kwargs):
+        return plugin(*args, **kwargs)
+
+    timed = stats.timed(call_plugin)
+
+    assert timed('add', lambda a, b: a + b, 1, b=2) == 3
+    assert timed('add', lambda a, b: a + b, 3, b=4) == 7
+
+    stats.record_plugin('other', 5)
+
+    assert stats.plugins['add']['calls'] == 2
+    assert stats.plugins['other'] == {'calls': 1, 'total': 5, 'max': 5}
+
+
+def test_stats_export_and_reset():
+    stats = ParseStats()
+
+    stats.record_phase('parse', 1)
+    stats.record_statement(2, 3)
+    stats.record_plugin('fn', 4)
+
+    assert stats.as_dict() == {
+        'phases': {'parse': 1},
+        'statements': [{'lineno': 2, 'duration': 3}],
+        'plugins': {'fn': {'calls': 1, 'total': 4, 'max': 4}},
+    }
+
+    stats.reset()
+
+    assert stats.as_dict() == {'phases': {}, 'statements': [], 'plugins': {}}
@@ -0,0 +1,74 @@
+import io
+import textwrap
+import tokenize
+
+import pytest
+
+from safeparser.streaming import iter_statements
+
+
+def statements(content):
+    return list(iter_statements(io.StringIO(content).readline))
+
+
+def test_statements_are_split_at_top_level_newlines():
+    assert statements('a = 0\nb = 1\n') == [(1, 'a = 0\n'), (2, 'b = 1\n')]
+
+
+def test_statements_can_span_multiple_lines():
+    content = textwrap.dedent('''\
+        a = [
+            0,
+            1,
+        ]
+        b = 1
+    ''')
+
+    assert statements(content) == [
+        (1, 'a = [\n    0,\n    1,\n]\n'),
+        (5, 'b = 1\n'),
+    ]
+
+
+def test_comments_and_blank_lines_belong_to_the_next_statement():
+    content = '# comment\n\na = 0\n\n# trailing\n'
+
+    assert statements(content) == [(1, '# comment\n\na = 0\n')]
+
+
+def test_the_last_statement_does_not_need_a_newline():
+    assert statements('a = 0\nb = 1') == [(1, 'a = 0\n'), (2, 'b = 1')]
+
+
+def test_statements_are_yielded_before_reading_the_rest_of_the_input():
+    read = []
+    lines = iter(['a = 0\n', 'b = 1\n', ''])
+
+    def readline():
+        line = next(lines)
+        read.append(line)
+        return line
+
+    iterator = iter_statements(readline)
+
+    assert next(iterator) == (1, 'a = 0\n')
+    assert read == ['a = 0\n']
+
+
+def test_binary_input_is_decoded_as_source_files_are():
+    def binary_statements(content):
+        return list(iter_statements(io.BytesIO(content).readline))
+
+    assert binary_statements('a = "ç"\nb = 1\n'.encode()) == [
+        (1, 'a = "ç"\n'),
+        (2, 'b = 1\n'),
+    ]
+    assert binary_statements(b'\xef\xbb\xbfa = 0\n') == [(1, 'a = 0\n')]
+    assert binary_statements(
+        '# coding: latin-1\na = "ç"\n'.encode('latin-1')
+    ) == [(1, '# coding: latin-1\na = "ç"\n')]
+
+
+def test_unterminated_statements_raise_token_errors():
+    with pytest.raises(tokenize.TokenError):
+        statements('a = [\n0,\n')